@@ -5,14 +5,16 @@ Ritual File Renamer - GUI 應用程式
 
 import customtkinter as ctk
 from tkinter import filedialog, messagebox
+import os
+import queue
 import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 from datetime import datetime
-import shutil
 
-from src.ocr import extract_name_from_image, extract_name_fullpage
-from src.pairing import scan_media_files, pair_files, FilePair
-from src.compress import compress_image, compress_video, get_file_size_mb, COMPRESSION_PRESETS
+from src.pairing import scan_and_pair, FilePair
+from src.compress import COMPRESSION_PRESETS, detect_hw_encoder
+from src.processing import NamingFormat, ProcessConfig, generate_filename, process_group
 
 
 # 設定外觀
@@ -30,6 +32,13 @@ NAMING_FORMATS = {
     "序號": "{seq}",
 }
 
+# 主執行緒套用背景 UI 更新的間隔（毫秒）
+UI_POLL_MS = 50
+
+# 每個處理子行程預留給 OCR（Tesseract 單執行緒）與照片輸出執行緒的核心數，
+# 其餘核心才分給該行程的 ffmpeg
+WORKER_RESERVED_CORES = 1
+
 
 class RitualRenamerApp(ctk.CTk):
     def __init__(self):
@@ -49,7 +58,11 @@ class RitualRenamerApp(ctk.CTk):
         self.pairs = []
         self.is_processing = False
         
+        # 背景執行緒不直接操作 Tk，改把更新放進佇列，由主執行緒定期套用
+        self._ui_queue = queue.Queue()
+        
         self._create_widgets()
+        self.after(UI_POLL_MS, self._drain_ui)
     
     def _create_widgets(self):
         # 主容器
@@ -216,6 +229,41 @@ class RitualRenamerApp(ctk.CTk):
         )
         self.run_btn.pack(side="left", padx=10)
     
+    def _post_ui(self, kind: str, value) -> None:
+        """
+        由背景執行緒呼叫，把 UI 更新交給主執行緒
+        
+        kind: 'progress'（進度 0-1）、'status'（狀態文字）、'call'（在主執行緒執行的函式）
+        """
+        self._ui_queue.put((kind, value))
+    
+    def _drain_ui(self):
+        """取出佇列中的 UI 更新；進度與狀態只套用最新一筆，避免大量重繪"""
+        progress = None
+        status = None
+        calls = []
+        try:
+            while True:
+                kind, value = self._ui_queue.get_nowait()
+                if kind == "progress":
+                    progress = value
+                elif kind == "status":
+                    status = value
+                else:
+                    calls.append(value)
+        except queue.Empty:
+            pass
+        
+        try:
+            if progress is not None:
+                self.progress_bar.set(progress)
+            if status is not None:
+                self.status_label.configure(text=status)
+            for call in calls:
+                call()
+        finally:
+            self.after(UI_POLL_MS, self._drain_ui)
+    
     def _on_compress_toggle(self):
         """切換壓縮開關"""
         if self.compress_enabled.get():
@@ -238,16 +286,7 @@ class RitualRenamerApp(ctk.CTk):
     def _generate_filename(self, name: str, seq: int, date: datetime, ext: str, sub_seq: str = '') -> str:
         """根據選擇的格式生成檔名"""
         format_template = NAMING_FORMATS[self.naming_format.get()]
-        date_str = date.strftime("%Y%m%d")
-        seq_str = f"{seq:03d}{sub_seq}"  # 如 001a, 001b
-        
-        filename = format_template.format(
-            name=name,
-            seq=seq_str,
-            date=date_str
-        )
-        
-        return f"{filename}{ext}"
+        return generate_filename(format_template, name, seq, date, ext, sub_seq)
     
     def _select_input(self):
         folder = filedialog.askdirectory(title="選擇輸入資料夾")
@@ -275,60 +314,70 @@ class RitualRenamerApp(ctk.CTk):
         self.status_label.configure(text="掃描中...")
         self.preview_btn.configure(state="disabled")
         
+        # 在主執行緒先取出設定值，背景執行緒不讀 Tk 變數
+        pairing_choice = self.pairing_mode.get()
+        if '圖像' in pairing_choice:
+            mode = 'image'
+        elif '順序' in pairing_choice:
+            mode = 'order'
+        else:
+            mode = 'time'
+        naming_choice = self.naming_format.get()
+        compress_choice = self.compress_preset.get() if self.compress_enabled.get() else None
+        
+        def show_preview(text: str):
+            self.preview_text.configure(state="normal")
+            self.preview_text.delete("1.0", "end")
+            self.preview_text.insert("1.0", text)
+            self.preview_text.configure(state="disabled")
+        
+        def show_error(e: Exception):
+            messagebox.showerror("錯誤", f"掃描失敗: {e}")
+        
         def do_preview():
             try:
-                files = scan_media_files(input_path)
-                
-                # 取得配對模式
-                pairing_choice = self.pairing_mode.get()
-                if '圖像' in pairing_choice:
-                    mode = 'image'
-                elif '順序' in pairing_choice:
-                    mode = 'order'
-                else:
-                    mode = 'time'
-                self.pairs = pair_files(files, mode=mode)
-                
-                # 更新預覽
-                self.preview_text.configure(state="normal")
-                self.preview_text.delete("1.0", "end")
+                # 掃描與配對（EXIF 解析、圖像比對）在子行程執行，避免與 Tk 搶 GIL
+                with ProcessPoolExecutor(max_workers=1) as executor:
+                    files, self.pairs = executor.submit(scan_and_pair, input_path, mode).result()
                 
                 if not self.pairs:
-                    self.preview_text.insert("1.0", "沒有找到可配對的檔案\n")
+                    text = "沒有找到可配對的檔案\n"
                 else:
-                    photos = [f for f in files if not f.is_video]
-                    videos = [f for f in files if f.is_video]
-                    
-                    # 計算總大小
-                    total_size = sum(get_file_size_mb(p.photo.path) + get_file_size_mb(p.video.path) for p in self.pairs)
+                    video_count = len(files.videos)
+                    photo_count = len(files.photos)
                     
-                    summary = f"找到 {len(photos)} 張照片、{len(videos)} 部影片\n"
-                    summary += f"成功配對 {len(self.pairs)} 組（總計 {total_size:.1f} MB）\n"
-                    summary += f"命名格式: {self.naming_format.get()}\n"
-                    if self.compress_enabled.get():
-                        summary += f"壓縮: {self.compress_preset.get()}\n"
-                    summary += "=" * 50 + "\n\n"
+                    # 每組的大小只取一次，總計與逐筆列出共用
+                    sizes = [(p.photo_size_mb, p.video_size_mb) for p in self.pairs]
+                    total_size = sum(photo_size + video_size for photo_size, video_size in sizes)
                     
-                    for pair in self.pairs:
-                        photo_size = get_file_size_mb(pair.photo.path)
-                        video_size = get_file_size_mb(pair.video.path)
-                        
-                        summary += f"[{pair.sequence:03d}]\n"
-                        summary += f"  📷 {pair.photo.path.name} ({photo_size:.1f} MB)\n"
-                        summary += f"     時間: {pair.photo.created_time} [{pair.photo.time_source}]\n"
-                        summary += f"  🎬 {pair.video.path.name} ({video_size:.1f} MB)\n"
-                        summary += f"     時間: {pair.video.created_time} [{pair.video.time_source}]\n\n"
+                    # 以 list 收集後一次 join，避免大量字串相加
+                    parts = [
+                        f"找到 {photo_count} 張照片、{video_count} 部影片\n",
+                        f"成功配對 {len(self.pairs)} 組（總計 {total_size:.1f} MB）\n",
+                        f"命名格式: {naming_choice}\n",
+                    ]
+                    if compress_choice:
+                        parts.append(f"壓縮: {compress_choice}\n")
+                    parts.append("=" * 50 + "\n\n")
                     
-                    self.preview_text.insert("1.0", summary)
+                    for pair, (photo_size, video_size) in zip(self.pairs, sizes):
+                        parts.append(
+                            f"[{pair.sequence:03d}]\n"
+                            f"  📷 {pair.photo.name} ({photo_size:.1f} MB)\n"
+                            f"     時間: {pair.photo.created_time} [{pair.photo.time_source}]\n"
+                            f"  🎬 {pair.video.name} ({video_size:.1f} MB)\n"
+                            f"     時間: {pair.video.created_time} [{pair.video.time_source}]\n\n"
+                        )
+                    text = "".join(parts)
                 
-                self.preview_text.configure(state="disabled")
-                self.status_label.configure(text=f"預覽完成：{len(self.pairs)} 組配對")
+                self._post_ui("call", lambda: show_preview(text))
+                self._post_ui("status", f"預覽完成：{len(self.pairs)} 組配對")
                 
             except Exception as e:
-                messagebox.showerror("錯誤", f"掃描失敗: {e}")
-                self.status_label.configure(text="掃描失敗")
+                self._post_ui("call", lambda e=e: show_error(e))
+                self._post_ui("status", "掃描失敗")
             finally:
-                self.preview_btn.configure(state="normal")
+                self._post_ui("call", lambda: self.preview_btn.configure(state="normal"))
         
         threading.Thread(target=do_preview, daemon=True).start()
     
@@ -360,97 +409,131 @@ class RitualRenamerApp(ctk.CTk):
         self.run_btn.configure(state="disabled")
         self.preview_btn.configure(state="disabled")
         
-        # 取得壓縮設定
-        do_compress = self.compress_enabled.get()
-        if do_compress:
+        # 取得處理設定（子行程無法讀取 Tk 變數，先在主執行緒取值）
+        cfg = ProcessConfig(
+            output_dir=Path(output_path),
+            naming=NamingFormat.parse(NAMING_FORMATS[self.naming_format.get()]),
+            compress=self.compress_enabled.get()
+        )
+        if cfg.compress:
             preset = COMPRESSION_PRESETS[self.compress_preset.get()]
-            image_quality = preset["image_quality"]
-            video_crf = preset["video_crf"]
+            cfg.image_quality = preset["image_quality"]
+            cfg.video_crf = preset["video_crf"]
+        
+        def finish():
+            self.is_processing = False
+            self.run_btn.configure(state="normal")
+            self.preview_btn.configure(state="normal")
         
         def do_process():
             try:
-                output_dir = Path(output_path)
-                output_dir.mkdir(parents=True, exist_ok=True)
+                cfg.output_dir.mkdir(parents=True, exist_ok=True)
+                
+                # 影片壓縮使用的編碼器（硬體編碼器需實際試編，只在背景執行緒偵測一次）
+                if cfg.compress:
+                    cfg.video_encoder = detect_hw_encoder()
+                
+                # OCR 快取（依照片內容雜湊，重複的照片不需再辨識）
+                # OCR 模組（OpenCV、numpy、Tesseract）只在命名格式含姓名時才載入
+                ocr_cache = {}
+                if cfg.naming.uses_name:
+                    from src.ocr import image_digest, load_ocr_cache, save_ocr_cache
+                    from src.ocr_gpu import extract_names_batch, gpu_ocr_available
+                    ocr_cache = load_ocr_cache(cfg.output_dir)
+                
+                # 同一張照片的配對（1:N）合併為一個工作，照片只辨識與輸出一次
+                groups: dict[tuple[Path, int], list[FilePair]] = {}
+                for pair in self.pairs:
+                    groups.setdefault((pair.photo.path, pair.sequence), []).append(pair)
                 
                 total = len(self.pairs)
+                done = 0
+                
+                # 進度以檔案大小加權（大影片佔較多進度），大小皆為 0 時改用組數
+                group_bytes = {
+                    group_key: group[0].photo.size + sum(pair.video.size for pair in group)
+                    for group_key, group in groups.items()
+                }
+                total_bytes = sum(group_bytes.values())
+                done_bytes = 0
                 success = 0
                 ocr_failed = 0
                 errors = []
                 total_original_size = 0
                 total_output_size = 0
+                action = "壓縮中" if cfg.compress else "處理中"
                 
-                for i, pair in enumerate(self.pairs):
-                    try:
-                        # 更新進度
-                        progress = (i + 1) / total
-                        self.progress_bar.set(progress)
-                        
-                        if do_compress:
-                            self.status_label.configure(text=f"壓縮中 {i+1}/{total}: {pair.video.path.name}")
-                        else:
-                            self.status_label.configure(text=f"處理中 {i+1}/{total}: {pair.photo.path.name}")
-                        
-                        # OCR 提取姓名
-                        name = extract_name_from_image(pair.photo.path)
-                        if not name:
-                            name = extract_name_fullpage(pair.photo.path)
-                        if not name:
-                            name = f"UNKNOWN"
-                            ocr_failed += 1
-                        
-                        # 使用照片時間作為日期
-                        photo_date = pair.photo.created_time
-                        
-                        # 記錄原始大小
-                        original_photo_size = get_file_size_mb(pair.photo.path)
-                        original_video_size = get_file_size_mb(pair.video.path)
-                        total_original_size += original_photo_size + original_video_size
-                        
-                        # 生成新檔名
-                        sub = getattr(pair, 'sub_sequence', '')
-                        
-                        # 照片檔名（不帶子序號，同一張照片只輸出一次）
-                        photo_key = (pair.photo.path, pair.sequence)
-                        
-                        if do_compress:
-                            new_photo_name = self._generate_filename(name, pair.sequence, photo_date, ".jpg", "")
-                            new_video_name = self._generate_filename(name, pair.sequence, photo_date, ".mp4", sub)
-                        else:
-                            photo_ext = pair.photo.path.suffix.lower()
-                            video_ext = pair.video.path.suffix.lower()
-                            new_photo_name = self._generate_filename(name, pair.sequence, photo_date, photo_ext, "")
-                            new_video_name = self._generate_filename(name, pair.sequence, photo_date, video_ext, sub)
-                        
-                        new_photo = output_dir / new_photo_name
-                        new_video = output_dir / new_video_name
-                        
-                        # 照片只輸出一次
-                        if not new_photo.exists():
-                            if do_compress:
-                                compress_image(pair.photo.path, new_photo, quality=image_quality)
-                            else:
-                                shutil.copy2(pair.photo.path, new_photo)
+                # 有 GPU 版 PaddleOCR 時先在本行程整批辨識未快取的照片（模型只載入一次），
+                # 辨識失敗的照片仍交給子行程用 Tesseract 再試；
+                # 沒有時不預先計算雜湊，照片雜湊於下方交付工作時逐一計算
+                digests: dict[tuple[Path, int], str | None] = {}
+                if cfg.naming.uses_name and gpu_ocr_available():
+                    for group_key, group in groups.items():
+                        try:
+                            digests[group_key] = image_digest(group[0].photo.path)
+                        except OSError:
+                            digests[group_key] = None
+                    
+                    pending = [key for key, digest in digests.items() if digest is not None and digest not in ocr_cache]
+                    if pending:
+                        self._post_ui("status", "辨識姓名中...")
+                        names = extract_names_batch([groups[key][0].photo.path for key in pending])
+                        for key, name in zip(pending, names or []):
+                            if name:
+                                ocr_cache[digests[key]] = name
+                
+                # 各組互不相依，交給多個子行程平行處理（OCR、壓縮皆為 CPU 密集）
+                # 行程數不超過組數；每個行程除了 ffmpeg 還有 OCR 與照片輸出執行緒，
+                # 各行程分到的核心先預留給這兩條執行緒，剩下的才給 ffmpeg，避免超額訂閱
+                cpu_count = os.cpu_count() or 1
+                workers = max(1, min(cpu_count // (1 + WORKER_RESERVED_CORES), len(groups)))
+                cfg.ffmpeg_threads = max(1, cpu_count // workers - WORKER_RESERVED_CORES)
+                
+                with ProcessPoolExecutor(max_workers=workers) as executor:
+                    futures = {}
+                    for group_key, group in groups.items():
+                        # 命名格式不含姓名（如「序號」）時完全不做 OCR
+                        digest = digests.get(group_key)
+                        need_ocr = False
+                        if cfg.naming.uses_name:
+                            if group_key not in digests:
+                                try:
+                                    digest = image_digest(group[0].photo.path)
+                                except OSError:
+                                    pass
+                            need_ocr = digest not in ocr_cache
+                        future = executor.submit(process_group, group, cfg, ocr_cache.get(digest), need_ocr)
+                        futures[future] = (group_key, digest, need_ocr)
+                    
+                    for future in as_completed(futures):
+                        group_key, digest, need_ocr = futures[future]
+                        group = groups[group_key]
+                        photo_name = group[0].photo.name
                         
-                        # 影片每次都輸出（帶子序號）
-                        if do_compress:
-                            if not compress_video(pair.video.path, new_video, crf=video_crf):
-                                shutil.copy2(pair.video.path, new_video.with_suffix(pair.video.path.suffix.lower()))
+                        try:
+                            result = future.result()
+                        except Exception as e:
+                            errors.append(f"{photo_name}: {e}")
                         else:
-                            shutil.copy2(pair.video.path, new_video)
-                        
-                        # 計算輸出大小
-                        if new_photo.exists():
-                            total_output_size += get_file_size_mb(new_photo)
-                        if new_video.exists():
-                            total_output_size += get_file_size_mb(new_video)
-                        
-                        success += 1
+                            # 只快取辨識出的姓名，失敗的照片下次仍會重試
+                            if need_ocr and digest is not None and result.name:
+                                ocr_cache[digest] = result.name
+                            success += result.success
+                            ocr_failed += result.ocr_failed
+                            errors.extend(result.errors)
+                            total_original_size += result.original_size_mb
+                            total_output_size += result.output_size_mb
                         
-                    except Exception as e:
-                        errors.append(f"{pair.photo.path.name}: {e}")
+                        # 更新進度（交回主執行緒執行）
+                        done += len(group)
+                        done_bytes += group_bytes[group_key]
+                        self._post_ui("progress", done_bytes / total_bytes if total_bytes else done / total)
+                        self._post_ui("status", f"{action} {done}/{total}: {photo_name}")
                 
                 # 完成
-                self.progress_bar.set(1)
+                if cfg.naming.uses_name:
+                    save_ocr_cache(cfg.output_dir, ocr_cache)
+                self._post_ui("progress", 1)
                 
                 result_msg = f"處理完成！\n\n"
                 result_msg += f"✅ 成功: {success} 組\n"
@@ -461,7 +544,7 @@ class RitualRenamerApp(ctk.CTk):
                     for err in errors[:5]:
                         result_msg += f"   • {err}\n"
                 
-                if do_compress and total_original_size > 0:
+                if cfg.compress and total_original_size > 0:
                     reduction = (1 - total_output_size / total_original_size) * 100
                     result_msg += f"\n📦 原始大小: {total_original_size:.1f} MB\n"
                     result_msg += f"📦 輸出大小: {total_output_size:.1f} MB\n"
@@ -469,16 +552,14 @@ class RitualRenamerApp(ctk.CTk):
                 
                 result_msg += f"\n輸出位置: {output_path}"
                 
-                messagebox.showinfo("完成", result_msg)
-                self.status_label.configure(text=f"完成！成功處理 {success} 組")
+                self._post_ui("status", f"完成！成功處理 {success} 組")
+                self._post_ui("call", lambda: messagebox.showinfo("完成", result_msg))
                 
             except Exception as e:
-                messagebox.showerror("錯誤", f"處理失敗: {e}")
-                self.status_label.configure(text="處理失敗")
+                self._post_ui("status", "處理失敗")
+                self._post_ui("call", lambda e=e: messagebox.showerror("錯誤", f"處理失敗: {e}"))
             finally:
-                self.is_processing = False
-                self.run_btn.configure(state="normal")
-                self.preview_btn.configure(state="normal")
+                self._post_ui("call", finish)
         
         threading.Thread(target=do_process, daemon=True).start()
 
@@ -4,60 +4,53 @@ Ritual File Renamer - 主程式
 """
 
 import argparse
-import shutil
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 from tqdm import tqdm
 
-from src.ocr import extract_name_from_image, extract_name_fullpage
+from src.ocr import extract_name, load_ocr_cache, save_ocr_cache
 from src.pairing import scan_media_files, pair_files, FilePair
+from src.fileops import fast_copy
 
 
-def rename_and_copy(
+def _process_photo(
     pairs: list[FilePair],
-    output_dir: str | Path,
-    dry_run: bool = False
-) -> dict:
+    output_path: Path,
+    ocr_cache: dict,
+    dry_run: bool
+) -> tuple[int, int, list[dict]]:
     """
-    重命名配對的檔案並複製到輸出資料夾
+    處理同一張照片的所有配對（OCR 與照片複製只做一次）
     
-    Args:
-        pairs: 配對列表
-        output_dir: 輸出資料夾
-        dry_run: 如果為 True，只預覽不實際執行
-        
     Returns:
-        處理結果統計
+        (成功組數, OCR 失敗組數, 錯誤列表)
     """
-    output_path = Path(output_dir)
+    success = 0
+    ocr_failed = 0
+    errors = []
+    photo = pairs[0].photo
+    photo_copied = False
     
-    if not dry_run:
-        output_path.mkdir(parents=True, exist_ok=True)
+    try:
+        # OCR 提取姓名（區域辨識失敗會自動嘗試全頁辨識）
+        ocr_name = extract_name(photo.path, ocr_cache)
+    except Exception as e:
+        return 0, 0, [{'photo': photo.name, 'video': pair.video.name, 'error': str(e)} for pair in pairs]
     
-    stats = {
-        'success': 0,
-        'ocr_failed': 0,
-        'errors': []
-    }
-    
-    for pair in tqdm(pairs, desc="處理中"):
+    for pair in pairs:
         try:
-            # OCR 提取姓名
-            name = extract_name_from_image(pair.photo.path)
-            
-            if not name:
-                # 嘗試全頁辨識
-                name = extract_name_fullpage(pair.photo.path)
-            
+            name = ocr_name
             if not name:
                 # OCR 失敗，使用序號
                 name = f"UNKNOWN_{pair.sequence:03d}"
-                stats['ocr_failed'] += 1
-                print(f"\n警告: 無法辨識 {pair.photo.path.name}，使用序號命名")
+                ocr_failed += 1
+                print(f"\n警告: 無法辨識 {photo.name}，使用序號命名")
             
             # 生成新檔名
             seq = f"{pair.sequence:03d}"
-            photo_ext = pair.photo.path.suffix.lower()
-            video_ext = pair.video.path.suffix.lower()
+            photo_ext = photo.ext
+            video_ext = pair.video.ext
             
             # 統一影片格式為 .mp4（如果是 .mov 保持原樣）
             new_photo_name = f"{name}_{seq}{photo_ext}"
@@ -67,22 +60,81 @@ def rename_and_copy(
             new_video_path = output_path / new_video_name
             
             if dry_run:
-                print(f"\n[預覽] {pair.photo.path.name} → {new_photo_name}")
-                print(f"[預覽] {pair.video.path.name} → {new_video_name}")
+                print(f"\n[預覽] {photo.name} → {new_photo_name}")
+                print(f"[預覽] {pair.video.name} → {new_video_name}")
             else:
-                # 複製檔案（保留原檔）
-                shutil.copy2(pair.photo.path, new_photo_path)
-                shutil.copy2(pair.video.path, new_video_path)
+                # 複製檔案（保留原檔）；1:N 時照片只複製一次
+                if not photo_copied:
+                    fast_copy(photo.path, new_photo_path)
+                    photo_copied = True
+                fast_copy(pair.video.path, new_video_path)
             
-            stats['success'] += 1
+            success += 1
             
         except Exception as e:
-            stats['errors'].append({
-                'photo': pair.photo.path.name,
-                'video': pair.video.path.name,
+            errors.append({
+                'photo': photo.name,
+                'video': pair.video.name,
                 'error': str(e)
             })
     
+    return success, ocr_failed, errors
+
+
+def rename_and_copy(
+    pairs: list[FilePair],
+    output_dir: str | Path,
+    dry_run: bool = False
+) -> dict:
+    """
+    重命名配對的檔案並複製到輸出資料夾
+    
+    Args:
+        pairs: 配對列表
+        output_dir: 輸出資料夾
+        dry_run: 如果為 True，只預覽不實際執行
+        
+    Returns:
+        處理結果統計
+    """
+    output_path = Path(output_dir)
+    
+    if not dry_run:
+        output_path.mkdir(parents=True, exist_ok=True)
+    
+    stats = {
+        'success': 0,
+        'ocr_failed': 0,
+        'errors': []
+    }
+    
+    # OCR 快取（依照片內容雜湊，重複的照片不需再辨識）
+    ocr_cache = load_ocr_cache(output_path)
+    
+    # 同一張照片的配對（1:N）合併為一個工作
+    groups: dict[tuple[Path, int], list[FilePair]] = {}
+    for pair in pairs:
+        groups.setdefault((pair.photo.path, pair.sequence), []).append(pair)
+    
+    # 各組互不相依，平行處理（tesseract 為子行程、複製為 I/O，等待時釋放 GIL）；
+    # 統計只在主執行緒彙整，不需加鎖
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+        futures = {
+            executor.submit(_process_photo, group, output_path, ocr_cache, dry_run): len(group)
+            for group in groups.values()
+        }
+        
+        with tqdm(total=len(pairs), desc="處理中") as progress:
+            for future in as_completed(futures):
+                success, ocr_failed, errors = future.result()
+                stats['success'] += success
+                stats['ocr_failed'] += ocr_failed
+                stats['errors'].extend(errors)
+                progress.update(futures[future])
+    
+    if not dry_run:
+        save_ocr_cache(output_path, ocr_cache)
+    
     return stats
 
 
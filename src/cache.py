@@ -0,0 +1,56 @@
+"""
+快取模組 - 跨執行保存的 JSON 快取檔
+
+存放於使用者快取資料夾（預設 ~/.cache/ritual-renamer），
+重新預覽或重新執行時，未修改的檔案不必再解析
+"""
+
+from __future__ import annotations
+
+import os
+import json
+import logging
+from pathlib import Path
+
+# 設定 logger
+logger = logging.getLogger(__name__)
+
+# 快取資料夾（遵循 XDG_CACHE_HOME）
+CACHE_DIR = Path(os.environ.get('XDG_CACHE_HOME') or Path.home() / '.cache') / 'ritual-renamer'
+
+
+def cache_path(name: str) -> Path:
+    """快取檔路徑"""
+    return CACHE_DIR / f"{name}.json"
+
+
+def load_cache(name: str) -> dict:
+    """讀取快取，不存在或格式錯誤時返回空字典"""
+    path = cache_path(name)
+    try:
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logger.warning(f"快取讀取失敗，將重新建立 ({path}): {e}")
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def save_cache(name: str, data: dict) -> None:
+    """
+    寫入快取
+
+    先寫暫存檔再 os.replace，多個行程同時寫入時不會留下寫到一半的檔案
+    """
+    path = cache_path(name)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning(f"快取寫入失敗 ({path}): {e}")
+        tmp_path.unlink(missing_ok=True)
@@ -3,18 +3,26 @@
 保持解析度，降低檔案大小
 
 使用：
-- Pillow: JPEG 品質壓縮
+- Pillow: JPEG 品質壓縮（有安裝 PyTurboJPEG 時以 libjpeg-turbo 編碼）
 - ffmpeg: H.264 影片壓縮
 """
 
 from __future__ import annotations
 
 import subprocess
-import shutil
 import logging
+from functools import lru_cache
 from pathlib import Path
 from typing import TYPE_CHECKING
 
+from .fileops import fast_copy
+
+try:
+    # 選用：libjpeg-turbo（SIMD 加速的色彩轉換與 DCT），JPEG 編碼比 Pillow 快數倍
+    from turbojpeg import TurboJPEG, TJPF_RGB, TJPF_GRAY, TJSAMP_GRAY
+except ImportError:
+    TurboJPEG = None
+
 if TYPE_CHECKING:
     from PIL import Image as PILImage
 
@@ -28,6 +36,122 @@ COMPRESSION_PRESETS: dict[str, dict] = {
     "小檔案（品質略降）": {"image_quality": 60, "video_crf": 32},
 }
 
+# 軟體編碼器（所有 ffmpeg 皆有）
+SOFTWARE_ENCODER = 'libx264'
+
+# libx264 速度預設：faster 的編碼時間約為 medium 的一半，同 CRF 下檔案只略大
+X264_PRESET = 'faster'
+
+# 壓縮失敗時記錄的 ffmpeg 錯誤訊息長度（字元）
+FFMPEG_ERROR_TAIL = 500
+
+# 硬體編碼器（依優先順序）
+HW_ENCODERS = ('h264_videotoolbox', 'h264_nvenc', 'h264_qsv')
+
+
+def _encoder_works(encoder: str) -> bool:
+    """
+    以 1 幀測試畫面實際編碼一次，確認編碼器可用
+
+    ffmpeg -encoders 只列出編譯時支援的編碼器；沒有對應的 GPU、驅動或
+    硬體時（如沒有 NVIDIA 顯示卡的 nvenc）仍會列出，實際編碼才會失敗
+    """
+    try:
+        result = subprocess.run(
+            ['ffmpeg', '-hide_banner', '-loglevel', 'error',
+             '-f', 'lavfi', '-i', 'nullsrc=s=256x256',
+             '-frames:v', '1', '-c:v', encoder, '-f', 'null', '-'],
+            capture_output=True,
+            timeout=10
+        )
+    except (OSError, subprocess.TimeoutExpired):
+        return False
+    return result.returncode == 0
+
+
+@lru_cache(maxsize=1)
+def detect_hw_encoder() -> str:
+    """
+    偵測可用的 H.264 硬體編碼器（只偵測一次）
+
+    ffmpeg -encoders 有列出的硬體編碼器依優先順序實際試編 1 幀，
+    第一個成功的才採用，避免每支影片都先硬體編碼失敗再改用軟體編碼
+    
+    Returns:
+        編碼器名稱，無可用的硬體編碼器時為 libx264
+    """
+    try:
+        result = subprocess.run(
+            ['ffmpeg', '-hide_banner', '-encoders'],
+            capture_output=True,
+            text=True,
+            timeout=10
+        )
+    except (OSError, subprocess.TimeoutExpired):
+        return SOFTWARE_ENCODER
+    
+    available = {line.split()[1] for line in result.stdout.splitlines() if len(line.split()) > 1}
+    for encoder in HW_ENCODERS:
+        if encoder in available and _encoder_works(encoder):
+            return encoder
+    return SOFTWARE_ENCODER
+
+
+def _video_codec_args(encoder: str, crf: int) -> list[str]:
+    """將 CRF 品質參數轉換為各編碼器對應的參數"""
+    if encoder == 'h264_videotoolbox':
+        # -q:v 1-100，越高品質越好（CRF 23 ≈ 64、28 ≈ 54）
+        return ['-c:v', encoder, '-q:v', str(max(1, min(100, 110 - 2 * crf)))]
+    if encoder == 'h264_nvenc':
+        return ['-c:v', encoder, '-preset', 'p5', '-tune', 'hq', '-rc', 'vbr', '-cq', str(crf), '-b:v', '0']
+    if encoder == 'h264_qsv':
+        return ['-c:v', encoder, '-global_quality', str(crf)]
+    return ['-c:v', SOFTWARE_ENCODER, '-crf', str(crf)]
+
+
+@lru_cache(maxsize=1)
+def _get_turbojpeg():
+    """取得 TurboJPEG 實例，未安裝或找不到 libturbojpeg 時返回 None"""
+    if TurboJPEG is None:
+        return None
+    try:
+        return TurboJPEG()
+    except (OSError, RuntimeError) as e:
+        logger.info(f"libturbojpeg 無法載入，改用 Pillow 編碼: {e}")
+        return None
+
+
+def _encode_jpeg_turbo(img: PILImage.Image, quality: int, exif: bytes) -> bytes | None:
+    """
+    以 libjpeg-turbo 編碼 JPEG（img 須為 RGB 或 L）
+    
+    EXIF 以 APP1 區段插入在 JFIF APP0 之後（與 Pillow 輸出的區段順序相同）；
+    無法使用時返回 None
+    
+    TurboJPEG 不像 Pillow 的 optimize=True 另外計算最佳化 Huffman 表，
+    同品質下檔案較大（一般照片約多 5%，小圖或大面積單色的圖比例更高），換取較快的編碼速度
+    """
+    jpeg = _get_turbojpeg()
+    if jpeg is None:
+        return None
+    
+    import numpy as np
+    
+    arr = np.asarray(img)
+    if img.mode == 'L':
+        data = jpeg.encode(arr[:, :, None], quality=quality, pixel_format=TJPF_GRAY, jpeg_subsample=TJSAMP_GRAY)
+    else:
+        data = jpeg.encode(arr, quality=quality, pixel_format=TJPF_RGB)
+    
+    # APP1 長度欄位為 2 bytes（含自身），超過上限的 EXIF 只能捨棄
+    if exif and len(exif) + 2 <= 0xFFFF:
+        # SOI 之後若為 APP0（JFIF），EXIF 接在 APP0 之後
+        pos = 2
+        if data[2:4] == b'\xff\xe0':
+            pos = 4 + int.from_bytes(data[4:6], 'big')
+        data = data[:pos] + b'\xff\xe1' + (len(exif) + 2).to_bytes(2, 'big') + exif + data[pos:]
+    return data
+
 
 def compress_image(
     input_path: Path,
@@ -56,8 +180,14 @@ def compress_image(
             if img.mode not in ('RGB', 'L'):
                 img = img.convert('RGB')
             
-            # 儲存為 JPEG
+            # 儲存為 JPEG（優先使用 libjpeg-turbo）
             output_jpg = output_path.with_suffix('.jpg')
+            data = _encode_jpeg_turbo(img, quality, exif)
+            if data is not None:
+                with open(output_jpg, 'wb') as f:
+                    f.write(data)
+                return True
+            
             save_kwargs = {'quality': quality, 'optimize': True}
             if exif:
                 save_kwargs['exif'] = exif
@@ -68,11 +198,11 @@ def compress_image(
         
     except ImportError:
         logger.error("Pillow 未安裝，無法壓縮圖片")
-        shutil.copy2(input_path, output_path)
+        fast_copy(input_path, output_path)
         return False
     except Exception as e:
         logger.warning(f"圖片壓縮失敗 ({input_path.name}): {e}")
-        shutil.copy2(input_path, output_path)
+        fast_copy(input_path, output_path)
         return False
 
 
@@ -80,7 +210,9 @@ def compress_video(
     input_path: Path,
     output_path: Path,
     crf: int = 28,
-    preset: str = "medium"
+    preset: str = X264_PRESET,
+    encoder: str = SOFTWARE_ENCODER,
+    threads: int = 0
 ) -> bool:
     """
     壓縮影片為 MP4 格式（H.264 編碼）
@@ -92,31 +224,51 @@ def compress_video(
              - 18-22: 幾乎無損
              - 23-28: 高品質
              - 29-32: 中等品質
-        preset: 編碼速度 (ultrafast/fast/medium/slow)
+        preset: 編碼速度 (ultrafast/veryfast/faster/fast/medium/slow)，僅 libx264 使用
+        encoder: 視訊編碼器（見 detect_hw_encoder），硬體編碼失敗時改用 libx264
+        threads: ffmpeg 編碼執行緒數，0 表示由 ffmpeg 自動決定（多個壓縮同時進行時應限制）
         
     Returns:
         是否成功
     """
     output_mp4 = output_path.with_suffix('.mp4')
     
+    codec_args = _video_codec_args(encoder, crf)
+    if encoder == SOFTWARE_ENCODER:
+        codec_args += ['-preset', preset]
+    if threads > 0:
+        codec_args += ['-threads', str(threads)]
+    
+    # 只輸出錯誤訊息（不輸出進度），stderr 由 capture_output 收集
     cmd = [
-        'ffmpeg', '-y', '-i', str(input_path),
-        '-c:v', 'libx264',
-        '-crf', str(crf),
-        '-preset', preset,
+        'ffmpeg', '-y', '-hide_banner', '-nostats', '-loglevel', 'error',
+        '-i', str(input_path),
+        *codec_args,
         '-c:a', 'aac', '-b:a', '128k',
         '-movflags', '+faststart',
         str(output_mp4)
     ]
     
     try:
+        # stdout 不需要；stderr 只有錯誤訊息（-loglevel error），失敗時記錄結尾
         result = subprocess.run(
             cmd,
-            capture_output=True,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
             text=True,
+            errors='replace',
             timeout=300
         )
-        return result.returncode == 0
+        if result.returncode == 0:
+            return True
+        
+        error_tail = result.stderr.strip()[-FFMPEG_ERROR_TAIL:]
+        if encoder != SOFTWARE_ENCODER:
+            # 硬體編碼器存在但無法使用（如沒有 GPU），改用軟體編碼
+            logger.warning(f"{encoder} 編碼失敗，改用 {SOFTWARE_ENCODER} ({input_path.name}): {error_tail}")
+            return compress_video(input_path, output_path, crf, preset, threads=threads)
+        logger.warning(f"影片壓縮失敗 ({input_path.name}): {error_tail}")
+        return False
         
     except FileNotFoundError:
         logger.error("ffmpeg 未安裝，無法壓縮影片")
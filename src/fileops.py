@@ -0,0 +1,71 @@
+"""
+檔案操作模組 - 快速複製
+
+在支援 copy-on-write 的檔案系統上直接複製資料區塊參照
+（Linux Btrfs/XFS 用 reflink，macOS APFS 用 clonefile），
+大型影片幾乎瞬間完成；其他情況交給 shutil.copyfile
+（Python 3.8+ 在 Linux 會用 sendfile、在 macOS 會用 fcopyfile）
+"""
+
+from __future__ import annotations
+
+import os
+import sys
+import shutil
+from functools import lru_cache
+from pathlib import Path
+
+# Linux ioctl FICLONE：_IOW(0x94, 9, int)
+FICLONE = 0x40049409
+
+
+@lru_cache(maxsize=1)
+def _clonefile_func():
+    """取得 macOS libSystem 的 clonefile()，無法取得時返回 None"""
+    import ctypes
+
+    try:
+        libsystem = ctypes.CDLL('/usr/lib/libSystem.B.dylib', use_errno=True)
+        func = libsystem.clonefile
+    except (OSError, AttributeError):
+        return None
+    func.argtypes = (ctypes.c_char_p, ctypes.c_char_p, ctypes.c_int)
+    func.restype = ctypes.c_int
+    return func
+
+
+def _try_clonefile(src: Path, dst: Path) -> bool:
+    """嘗試以 APFS clonefile 複製（目的檔不可已存在）"""
+    func = _clonefile_func()
+    if func is None:
+        return False
+    return func(os.fsencode(src), os.fsencode(dst), 0) == 0
+
+
+def _try_reflink(src: Path, dst: Path) -> bool:
+    """嘗試以 reflink 複製（共用資料區塊，不實際搬移資料）"""
+    if sys.platform == 'darwin':
+        return _try_clonefile(src, dst)
+    if not sys.platform.startswith('linux'):
+        return False
+
+    import fcntl
+
+    try:
+        with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        return True
+    except OSError:
+        # 不同檔案系統或不支援 reflink
+        return False
+
+
+def fast_copy(src: Path, dst: Path) -> None:
+    """
+    複製檔案並保留權限與時間戳（同 shutil.copy2）
+
+    優先使用 reflink / clonefile，失敗則一般複製
+    """
+    if not _try_reflink(src, dst):
+        shutil.copyfile(src, dst)
+    shutil.copystat(src, dst)
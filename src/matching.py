@@ -4,32 +4,88 @@
 
 import cv2
 import numpy as np
+from PIL import Image, ImageOps
 from pathlib import Path
 from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+
+from .cache import load_cache, save_cache
+import os
 import subprocess
-import tempfile
+import threading
+
+
+# pHash 相似度門檻（64 bit 中至少 42 bit 相同），只用來排除沒有對應影片的照片，
+# 有多部候選影片時仍取最相似者。不相關圖片的 pHash 相似度約 0.5：
+# 各 bit 獨立時達到 0.65 的機率約 0.8%；同一畫面經縮圖、重新壓縮、
+# 亮度與 3～5% 裁切後多在 0.7 以上（平均 0.82～0.87）
+PHASH_THRESHOLD = 0.65
+
+# pHash 相似度差距在此範圍內（約 3 bit）視為平手，改用 ORB 決定
+PHASH_TIE_BAND = 3 / 64
+
+# pHash 輸入尺寸（ffmpeg 直接輸出此尺寸的灰階幀）
+PHASH_INPUT_SIZE = 32
+
+# 每部影片取樣的關鍵幀數量上限
+MAX_KEYFRAMES = 5
+
+# ORB 比對前統一縮小的尺寸，以及視為好匹配的最大距離
+ORB_TARGET_SIZE = (400, 300)
+ORB_MAX_DISTANCE = 50
+
+# pHash 快取名稱（重新預覽時不必再解碼照片與影片）
+PHASH_CACHE_NAME = 'phash'
 
 
 def extract_video_frame(video_path: Path, frame_time: float = 0.5) -> Optional[np.ndarray]:
     """
-    從影片擷取指定時間的幀
+    從影片擷取指定時間的幀（縮成 ORB_TARGET_SIZE）
+    
+    以 ffmpeg 輸入端 seek（-ss 放在 -i 前）直接跳到最近的關鍵幀，
+    不必從頭解碼；ffmpeg 無法使用時改用 OpenCV
     
     Args:
         video_path: 影片路徑
         frame_time: 擷取時間（秒），預設 0.5 秒（影片開頭）
         
     Returns:
-        OpenCV 圖像 (numpy array)，失敗返回 None
+        OpenCV 圖像 (numpy array, BGR)，失敗返回 None
     """
+    width, height = ORB_TARGET_SIZE
+    cmd = [
+        'ffmpeg', '-v', 'error',
+        '-ss', str(frame_time),
+        '-i', str(video_path),
+        '-frames:v', '1',
+        '-vf', f'scale={width}:{height}',
+        '-pix_fmt', 'bgr24',
+        '-f', 'rawvideo', 'pipe:1'
+    ]
+    
     try:
-        cap = cv2.VideoCapture(str(video_path))
+        result = subprocess.run(cmd, capture_output=True, timeout=30)
+        if len(result.stdout) == width * height * 3:
+            return np.frombuffer(result.stdout, dtype=np.uint8).reshape(height, width, 3)
+    except (OSError, subprocess.TimeoutExpired):
+        pass
+    
+    frame = _extract_video_frame_cv2(video_path, frame_time)
+    return None if frame is None else cv2.resize(frame, ORB_TARGET_SIZE, interpolation=cv2.INTER_AREA)
+
+
+def _extract_video_frame_cv2(video_path: Path, frame_time: float) -> Optional[np.ndarray]:
+    """以 OpenCV 擷取指定時間的幀（原始尺寸）"""
+    try:
+        # 直接指定 FFmpeg 後端，不必逐一嘗試；此版本 OpenCV 沒有 FFmpeg 時改用預設後端
+        cap = cv2.VideoCapture(str(video_path), cv2.CAP_FFMPEG)
+        if not cap.isOpened():
+            cap = cv2.VideoCapture(str(video_path))
         if not cap.isOpened():
             return None
         
-        # 設定到指定時間
-        fps = cap.get(cv2.CAP_PROP_FPS)
-        frame_number = int(frame_time * fps)
-        cap.set(cv2.CAP_PROP_POS_FRAMES, frame_number)
+        # 以時間設定位置（FFmpeg 以關鍵幀 seek），不必讀取 fps 換算幀號
+        cap.set(cv2.CAP_PROP_POS_MSEC, frame_time * 1000)
         
         ret, frame = cap.read()
         cap.release()
@@ -43,6 +99,51 @@ def extract_video_frame(video_path: Path, frame_time: float = 0.5) -> Optional[n
         return None
 
 
+def extract_keyframes(
+    video_path: Path,
+    max_frames: int = MAX_KEYFRAMES,
+    size: int = PHASH_INPUT_SIZE
+) -> Optional[np.ndarray]:
+    """
+    用單一 ffmpeg 行程擷取影片開頭的關鍵幀（灰階、縮小）
+    
+    只解碼 I-frame，縮圖後以 raw 灰階像素從 stdout 讀回，
+    不必為每一幀各開一次行程或寫暫存檔
+    
+    Returns:
+        shape 為 (N, size, size) 的 uint8 陣列，失敗返回 None
+    """
+    cmd = [
+        'ffmpeg', '-v', 'error',
+        '-skip_frame', 'nokey', '-i', str(video_path),
+        '-frames:v', str(max_frames),
+        # -fps_mode 要 ffmpeg 5.1 以上才有；-vsync 舊版都支援，新版仍可使用
+        '-vsync', 'passthrough',
+        '-vf', f'scale={size}:{size}:flags=area',
+        '-pix_fmt', 'gray',
+        '-f', 'rawvideo', 'pipe:1'
+    ]
+    
+    try:
+        result = subprocess.run(cmd, capture_output=True, timeout=30)
+    except FileNotFoundError:
+        # 沒有 ffmpeg，由呼叫端改用 OpenCV
+        return None
+    except subprocess.TimeoutExpired:
+        print(f"擷取關鍵幀逾時 ({video_path})")
+        return None
+    
+    frame_bytes = size * size
+    num_frames = len(result.stdout) // frame_bytes
+    if result.returncode != 0 or num_frames == 0:
+        error = result.stderr.decode(errors='replace').strip()[-500:]
+        print(f"擷取關鍵幀失敗 ({video_path}): {error or '沒有可用的影格'}")
+        return None
+    
+    data = result.stdout[:num_frames * frame_bytes]
+    return np.frombuffer(data, dtype=np.uint8).reshape(num_frames, size, size)
+
+
 def load_image(image_path: Path) -> Optional[np.ndarray]:
     """載入圖片"""
     try:
@@ -53,6 +154,74 @@ def load_image(image_path: Path) -> Optional[np.ndarray]:
         return None
 
 
+def load_image_for_phash(image_path: Path) -> Optional[np.ndarray]:
+    """
+    載入圖片供 pHash 使用（灰階、縮小解碼）
+    
+    JPEG 以 draft() 讓 libjpeg 直接以 1/2～1/8 解碼，不必解出完整的原圖；
+    依 EXIF 方向轉正（與 cv2.imread、影片幀一致）
+    """
+    try:
+        with Image.open(image_path) as img:
+            img.draft('L', (PHASH_INPUT_SIZE, PHASH_INPUT_SIZE))
+            img = ImageOps.exif_transpose(img)
+            return np.asarray(img.convert('L'))
+    except Exception as e:
+        print(f"載入圖片失敗 ({image_path}): {e}")
+        return None
+
+
+# 每個執行緒各自的 ORB 偵測器與 BFMatcher（OpenCV 物件不保證可跨執行緒共用）
+_orb_local = threading.local()
+
+
+def _orb_tools() -> tuple:
+    """取得本執行緒的 (ORB, BFMatcher)，只建立一次"""
+    tools = getattr(_orb_local, 'tools', None)
+    if tools is None:
+        tools = (
+            cv2.ORB_create(nfeatures=500),
+            cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True),
+        )
+        _orb_local.tools = tools
+    return tools
+
+
+def orb_features(img: np.ndarray) -> tuple[np.ndarray, int, Optional[np.ndarray]]:
+    """
+    計算圖片的 ORB 特徵（每張圖只算一次，可與多張圖重複比對）
+    
+    Returns:
+        (縮小後的灰階圖, 特徵點數量, 描述子)
+    """
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
+    gray = cv2.resize(gray, ORB_TARGET_SIZE)
+    
+    orb, _ = _orb_tools()
+    keypoints, descriptors = orb.detectAndCompute(gray, None)
+    return gray, len(keypoints), descriptors
+
+
+def orb_similarity(features1: tuple, features2: tuple) -> float:
+    """以預先計算的 ORB 特徵比對，返回 0-1 的相似度分數"""
+    gray1, count1, des1 = features1
+    gray2, count2, des2 = features2
+    
+    if des1 is None or des2 is None:
+        # 無法偵測特徵點，使用直方圖比對
+        return histogram_similarity(gray1, gray2)
+    
+    if count1 == 0 or count2 == 0:
+        return 0.0
+    
+    _, matcher = _orb_tools()
+    matches = matcher.match(des1, des2)
+    
+    # 計算相似度（好的匹配數 / 較少的特徵點數）
+    good_matches = sum(1 for m in matches if m.distance < ORB_MAX_DISTANCE)
+    return min(good_matches / min(count1, count2), 1.0)
+
+
 def compute_similarity(img1: np.ndarray, img2: np.ndarray) -> float:
     """
     計算兩張圖片的相似度
@@ -60,38 +229,7 @@ def compute_similarity(img1: np.ndarray, img2: np.ndarray) -> float:
     使用 ORB 特徵點匹配，返回 0-1 的相似度分數
     """
     try:
-        # 轉灰階
-        gray1 = cv2.cvtColor(img1, cv2.COLOR_BGR2GRAY)
-        gray2 = cv2.cvtColor(img2, cv2.COLOR_BGR2GRAY)
-        
-        # 調整大小以加速比對
-        target_size = (400, 300)
-        gray1 = cv2.resize(gray1, target_size)
-        gray2 = cv2.resize(gray2, target_size)
-        
-        # 使用 ORB 特徵點
-        orb = cv2.ORB_create(nfeatures=500)
-        kp1, des1 = orb.detectAndCompute(gray1, None)
-        kp2, des2 = orb.detectAndCompute(gray2, None)
-        
-        if des1 is None or des2 is None:
-            # 無法偵測特徵點，使用直方圖比對
-            return histogram_similarity(gray1, gray2)
-        
-        # BFMatcher
-        bf = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True)
-        matches = bf.match(des1, des2)
-        
-        # 計算相似度（匹配數 / 總特徵點數）
-        if len(kp1) == 0 or len(kp2) == 0:
-            return 0.0
-        
-        # 過濾好的匹配
-        good_matches = [m for m in matches if m.distance < 50]
-        
-        similarity = len(good_matches) / min(len(kp1), len(kp2))
-        return min(similarity, 1.0)
-        
+        return orb_similarity(orb_features(img1), orb_features(img2))
     except Exception as e:
         print(f"計算相似度失敗: {e}")
         return 0.0
@@ -113,6 +251,93 @@ def histogram_similarity(img1: np.ndarray, img2: np.ndarray) -> float:
         return 0.0
 
 
+def compute_phash(img: np.ndarray) -> int:
+    """
+    計算圖片的感知雜湊（pHash）
+    
+    縮成 32x32 灰階 → DCT → 取左上 8x8 低頻係數 → 與中位數比較，
+    得到 64 bit 整數；相似的圖片雜湊值只差少數 bit
+    """
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
+    small = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA)
+    low_freq = cv2.dct(np.float32(small))[:8, :8]
+    bits = (low_freq > np.median(low_freq)).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def phash_similarity(hash1: int, hash2: int) -> float:
+    """用漢明距離計算兩個 pHash 的相似度（0-1）"""
+    return 1.0 - (hash1 ^ hash2).bit_count() / 64
+
+
+def load_phash_cache() -> dict[str, list[int]]:
+    """讀取 pHash 快取，不存在或格式錯誤時返回空字典（略過舊版留下的空結果）"""
+    return {key: hashes for key, hashes in load_cache(PHASH_CACHE_NAME).items() if hashes}
+
+
+def save_phash_cache(cache: dict[str, list[int]]) -> None:
+    """寫入 pHash 快取"""
+    save_cache(PHASH_CACHE_NAME, cache)
+
+
+def _phash_cache_key(path: Path, known: Optional[tuple[int, int]] = None) -> Optional[str]:
+    """
+    pHash 快取的 key：(路徑, 修改時間, 大小)
+    
+    檔案被修改後 key 不同，自然會重新計算；檔案無法讀取時返回 None
+    known 為掃描時已取得的 (st_mtime_ns, st_size)，有提供就不再 stat
+    """
+    if known is None:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        known = (stat.st_mtime_ns, stat.st_size)
+    mtime_ns, size = known
+    return f"{path}|{mtime_ns}|{size}"
+
+
+def _prune_phash_cache(cache: dict[str, list[int]], used: set[str]) -> None:
+    """
+    移除過期的 pHash 快取項目，避免快取無限增長
+
+    保留本次用到的項目，以及檔案仍存在且未修改的項目（其他資料夾的檔案）；
+    同一路徑只 stat 一次
+    """
+    stats: dict[str, Optional[tuple[int, int]]] = {}
+    for key in [key for key in cache if key not in used]:
+        try:
+            path, mtime_ns, size = key.rsplit('|', 2)
+            expected = (int(mtime_ns), int(size))
+        except ValueError:
+            del cache[key]
+            continue
+        if path not in stats:
+            try:
+                stat = os.stat(path)
+                stats[path] = (stat.st_mtime_ns, stat.st_size)
+            except OSError:
+                stats[path] = None
+        if stats[path] != expected:
+            del cache[key]
+
+
+def _photo_hashes(photo_path: Path) -> list[int]:
+    """照片的 pHash（讀取失敗時為空列表）"""
+    photo_img = load_image_for_phash(photo_path)
+    return [] if photo_img is None else [compute_phash(photo_img)]
+
+
+def _video_hashes(video_path: Path) -> list[int]:
+    """影片開頭數個關鍵幀的 pHash（每幀一個）"""
+    frames = extract_keyframes(video_path)
+    if frames is None:
+        # ffmpeg 無法使用時，退回 OpenCV 擷取單幀
+        frame = extract_video_frame(video_path)
+        frames = [] if frame is None else [frame]
+    return [compute_phash(f) for f in frames]
+
+
 def find_best_video_match(photo_path: Path, video_paths: list[Path]) -> tuple[Optional[Path], float]:
     """
     為一張照片找到最佳匹配的影片
@@ -128,15 +353,25 @@ def find_best_video_match(photo_path: Path, video_paths: list[Path]) -> tuple[Op
     if photo_img is None:
         return None, 0.0
     
+    # 照片特徵只算一次，與每部影片比對
+    photo_features = orb_features(photo_img)
+    
+    # 各影片的幀平行擷取（ffmpeg 為獨立子行程）
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+        frames = list(executor.map(extract_video_frame, video_paths))
+    
     best_match = None
     best_score = 0.0
     
-    for video_path in video_paths:
-        frame = extract_video_frame(video_path)
+    for video_path, frame in zip(video_paths, frames):
         if frame is None:
             continue
         
-        score = compute_similarity(photo_img, frame)
+        try:
+            score = orb_similarity(photo_features, orb_features(frame))
+        except Exception as e:
+            print(f"計算相似度失敗: {e}")
+            continue
         
         if score > best_score:
             best_score = score
@@ -148,38 +383,65 @@ def find_best_video_match(photo_path: Path, video_paths: list[Path]) -> tuple[Op
 def match_photos_to_videos(
     photo_paths: list[Path],
     video_paths: list[Path],
-    threshold: float = 0.1,
-    multi_video: bool = True
+    threshold: float = PHASH_THRESHOLD,
+    multi_video: bool = True,
+    file_stats: Optional[dict[Path, tuple[int, int]]] = None
 ) -> list[tuple[Path, list[tuple[Path, float]]]]:
     """
-    用圖像相似度配對所有照片和影片
+    用圖像相似度（pHash）配對所有照片和影片
     
     支援 1:N 配對（一張照片配多個影片）
     
     Args:
         photo_paths: 照片路徑列表
         video_paths: 影片路徑列表
-        threshold: 最低相似度門檻
+        threshold: 最低 pHash 相似度門檻
         multi_video: 是否允許一張照片配多個影片
+        file_stats: 已知的 {路徑: (st_mtime_ns, st_size)}，用於快取 key
         
     Returns:
         [(照片路徑, [(影片路徑, 相似度), ...]), ...]
     """
-    # 先計算每張照片對所有影片的相似度
-    photo_video_scores = {}
+    # 每張照片、每部影片只解碼一次，各自算出 pHash（未修改的檔案直接取快取）
+    # 影片取開頭數個關鍵幀，每幀一個 pHash
+    cache = load_phash_cache()
+    file_stats = file_stats or {}
+    keys = {path: _phash_cache_key(path, file_stats.get(path)) for path in [*photo_paths, *video_paths]}
     
+    jobs = [(path, _photo_hashes) for path in photo_paths]
+    jobs += [(path, _video_hashes) for path in video_paths]
+    missing = [(path, compute) for path, compute in jobs if keys[path] is not None and keys[path] not in cache]
+    
+    # 未快取的檔案平行計算（ffmpeg 在子行程解碼、OpenCV 解碼時釋放 GIL，用執行緒即可）
+    # 解碼失敗（空結果）不寫入快取：可能只是暫時無法讀取，下次掃描再重試
+    if missing:
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+            results = executor.map(lambda job: job[1](job[0]), missing)
+            for (path, _), hashes in zip(missing, results):
+                if hashes:
+                    cache[keys[path]] = hashes
+        _prune_phash_cache(cache, set(keys.values()))
+        save_phash_cache(cache)
+    
+    photo_hashes = {}
     for photo_path in photo_paths:
-        photo_img = load_image(photo_path)
-        if photo_img is None:
-            continue
-        
+        hashes = cache.get(keys[photo_path])
+        if hashes:
+            photo_hashes[photo_path] = hashes[0]
+    
+    video_hashes = {}
+    for video_path in video_paths:
+        hashes = cache.get(keys[video_path])
+        if hashes:
+            video_hashes[video_path] = hashes
+    
+    # 計算每張照片對所有影片的相似度（整數 XOR + popcount，取最相似的關鍵幀）
+    photo_video_scores = {}
+    
+    for photo_path, photo_hash in photo_hashes.items():
         scores = []
-        for video_path in video_paths:
-            frame = extract_video_frame(video_path)
-            if frame is None:
-                continue
-            
-            score = compute_similarity(photo_img, frame)
+        for video_path, hashes in video_hashes.items():
+            score = max(phash_similarity(photo_hash, h) for h in hashes)
             if score >= threshold:
                 scores.append((video_path, score))
         
@@ -187,20 +449,46 @@ def match_photos_to_videos(
         scores.sort(key=lambda x: x[1], reverse=True)
         photo_video_scores[photo_path] = scores
     
+    # pHash 分數接近時，改用 ORB 特徵比對決定（特徵每個檔案只算一次）
+    orb_cache = {}
+    
+    def orb_score(photo_path: Path, video_path: Path) -> float:
+        if photo_path not in orb_cache:
+            img = load_image(photo_path)
+            orb_cache[photo_path] = None if img is None else orb_features(img)
+        if video_path not in orb_cache:
+            frame = extract_video_frame(video_path)
+            orb_cache[video_path] = None if frame is None else orb_features(frame)
+        
+        photo_features, video_features = orb_cache[photo_path], orb_cache[video_path]
+        if photo_features is None or video_features is None:
+            return 0.0
+        return orb_similarity(photo_features, video_features)
+    
+    def tied(candidates: list[tuple[Path, float]]) -> list[tuple[Path, float]]:
+        """與最高分差距在 PHASH_TIE_BAND 內的候選（candidates 已依分數由高到低排序）"""
+        return [c for c in candidates if candidates[0][1] - c[1] <= PHASH_TIE_BAND]
+    
     # 分配影片給照片
     results = []
     used_videos = set()
     
     if multi_video:
         # 1:N 模式：每個影片分配給相似度最高的照片
-        video_to_photo = {}  # video -> (photo, score)
-        
+        video_candidates = {}  # video -> [(photo, score), ...]
         for photo_path, scores in photo_video_scores.items():
             for video_path, score in scores:
-                if video_path not in video_to_photo:
-                    video_to_photo[video_path] = (photo_path, score)
-                elif score > video_to_photo[video_path][1]:
-                    video_to_photo[video_path] = (photo_path, score)
+                video_candidates.setdefault(video_path, []).append((photo_path, score))
+        
+        video_to_photo = {}  # video -> (photo, score)
+        for video_path, candidates in video_candidates.items():
+            # 穩定排序：同分時保留照片順序
+            candidates.sort(key=lambda x: x[1], reverse=True)
+            close = tied(candidates)
+            if len(close) > 1:
+                video_to_photo[video_path] = max(close, key=lambda c: orb_score(c[0], video_path))
+            else:
+                video_to_photo[video_path] = candidates[0]
         
         # 反轉：按照片分組影片
         photo_to_videos = {}
@@ -222,11 +510,18 @@ def match_photos_to_videos(
             if photo_path not in photo_video_scores:
                 continue
             
-            for video_path, score in photo_video_scores[photo_path]:
-                if video_path not in used_videos:
-                    results.append((photo_path, [(video_path, score)]))
-                    used_videos.add(video_path)
-                    break
+            available = [(v, s) for v, s in photo_video_scores[photo_path] if v not in used_videos]
+            if not available:
+                continue
+            
+            close = tied(available)
+            if len(close) > 1:
+                video_path, score = max(close, key=lambda c: orb_score(photo_path, c[0]))
+            else:
+                video_path, score = available[0]
+            
+            results.append((photo_path, [(video_path, score)]))
+            used_videos.add(video_path)
     
     return results
 
@@ -9,14 +9,19 @@ Metadata 模組 - 提取圖片/影片的原始拍攝時間
 
 from __future__ import annotations
 
+import io
+import os
+import struct
 import subprocess
 import json
 import logging
-from functools import lru_cache
+from functools import wraps
 from pathlib import Path
-from datetime import datetime
+from datetime import datetime, timedelta
 from typing import TYPE_CHECKING
 
+from .cache import load_cache, save_cache
+
 if TYPE_CHECKING:
     from typing import Optional
 
@@ -30,6 +35,19 @@ EXIF_DATE_TAGS = (
     'Image DateTime'
 )
 
+# JPEG 的 EXIF（APP1 區段最大 64 KiB）通常位於檔案開頭，先只讀取此範圍
+JPEG_EXIF_READ_LIMIT = 128 * 1024
+JPEG_EXTENSIONS = ('.jpg', '.jpeg')
+
+# ISO BMFF 容器（可直接從 moov/mvhd 讀取建立時間，不必呼叫 ffprobe）
+MP4_EXTENSIONS = ('.mp4', '.mov', '.m4v')
+
+# mvhd 時間的起點（UTC）；部分錄影程式誤寫 Unix 時間，
+# 與 ffmpeg 相同：數值小於 1904→1970 的秒數差時視為 Unix 時間
+MP4_EPOCH = datetime(1904, 1, 1)
+UNIX_EPOCH = datetime(1970, 1, 1)
+MP4_TO_UNIX_SECONDS = 2082844800
+
 # 影片 creation_time 可能的 key
 VIDEO_TIME_KEYS = ('creation_time', 'com.apple.quicktime.creationdate')
 
@@ -40,12 +58,103 @@ ISO_DATETIME_FORMATS = (
 )
 
 
-@lru_cache(maxsize=128)
+# metadata 快取："函式|路徑|inode|大小|修改時間" -> 結果（可存到磁碟，跨執行保留）
+METADATA_CACHE_NAME = 'metadata'
+_metadata_cache: dict[str, datetime] = {}
+_metadata_used: set[str] = set()  # 本次執行查詢過的 key
+_metadata_dirty = False
+
+
+def _stat_cached(func):
+    """
+    以檔案狀態為 key 快取結果（不限數量；檔案被覆寫後 key 不同，自動失效）
+    
+    只快取取得的時間；沒有結果（None）可能只是暫時失敗（exifread 未安裝、
+    ffprobe 無法使用或逾時、檔案同步中等），不快取，下次再讀
+    
+    被裝飾的函式可額外傳入 stat（如 DirEntry.stat()），避免重複 stat；
+    路徑也放進 key，因為 Windows 的 DirEntry.stat() 沒有 inode
+    """
+    @wraps(func)
+    def wrapper(path: Path, stat: Optional[os.stat_result] = None) -> Optional[datetime]:
+        global _metadata_dirty
+        if stat is None:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                return func(path)
+        
+        key = f"{func.__name__}|{path}|{stat.st_ino}|{stat.st_size}|{stat.st_mtime_ns}"
+        _metadata_used.add(key)
+        if key in _metadata_cache:
+            return _metadata_cache[key]
+        
+        result = func(path)
+        if result is not None:
+            _metadata_cache[key] = result
+            _metadata_dirty = True
+        return result
+    
+    return wrapper
+
+
+def load_metadata_cache() -> None:
+    """從磁碟載入 metadata 快取（合併到目前的快取；略過舊版留下的 None 結果）"""
+    for key, value in load_cache(METADATA_CACHE_NAME).items():
+        if key in _metadata_cache or not value:
+            continue
+        try:
+            _metadata_cache[key] = datetime.fromisoformat(value)
+        except (TypeError, ValueError):
+            continue
+
+
+def _is_current_entry(key: str, stats: dict[str, Optional[tuple[int, int]]]) -> bool:
+    """
+    快取項目對應的檔案是否仍存在且未被修改
+
+    只比對大小與修改時間（Windows 的 DirEntry.stat() 沒有 inode，與 os.stat 不同）；
+    stats 為 {路徑: (大小, 修改時間)}，同一路徑只 stat 一次
+    """
+    try:
+        _, rest = key.split('|', 1)
+        path, _, size, mtime_ns = rest.rsplit('|', 3)
+        expected = (int(size), int(mtime_ns))
+    except ValueError:
+        return False
+    if path not in stats:
+        try:
+            stat = os.stat(path)
+            stats[path] = (stat.st_size, stat.st_mtime_ns)
+        except OSError:
+            stats[path] = None
+    return stats[path] == expected
+
+
+def save_metadata_cache() -> None:
+    """
+    有新結果時，把 metadata 快取寫回磁碟
+
+    只保留本次查詢過的項目，以及檔案仍存在且未修改的項目（其他資料夾的檔案），
+    已刪除或已被覆寫的檔案的舊結果不再寫回，避免快取無限增長
+    """
+    global _metadata_dirty
+    if not _metadata_dirty:
+        return
+    stats: dict[str, Optional[tuple[int, int]]] = {}
+    for key in [key for key in _metadata_cache if key not in _metadata_used]:
+        if not _is_current_entry(key, stats):
+            del _metadata_cache[key]
+    save_cache(METADATA_CACHE_NAME, {key: value.isoformat() for key, value in _metadata_cache.items()})
+    _metadata_dirty = False
+
+
+@_stat_cached
 def get_exif_datetime(image_path: Path) -> Optional[datetime]:
     """
     從圖片 EXIF 中提取原始拍攝時間
     
-    使用 lru_cache 避免重複讀取同一檔案
+    以檔案狀態快取，避免重複讀取同一檔案
     
     優先順序：
     1. EXIF DateTimeOriginal (原始拍攝時間)
@@ -56,7 +165,20 @@ def get_exif_datetime(image_path: Path) -> Optional[datetime]:
         import exifread
         
         with open(image_path, 'rb') as f:
-            tags = exifread.process_file(f, details=False, stop_tag='EXIF DateTimeOriginal')
+            # JPEG 一次讀入開頭區塊，exifread 在記憶體中解析，不再逐段 read()
+            # （HEIC、PNG 的 EXIF 位置不固定，仍直接讀檔）
+            if image_path.suffix.lower() in JPEG_EXTENSIONS:
+                prefix = f.read(JPEG_EXIF_READ_LIMIT)
+                try:
+                    tags = exifread.process_file(io.BytesIO(prefix), details=False, stop_tag='EXIF DateTimeOriginal')
+                except Exception:
+                    tags = {}
+                # 開頭區塊找不到日期（EXIF 前有大型 APP 區段、EXIF 被截斷等）時改讀整個檔案
+                if len(prefix) == JPEG_EXIF_READ_LIMIT and not any(tag in tags for tag in EXIF_DATE_TAGS):
+                    f.seek(0)
+                    tags = exifread.process_file(f, details=False, stop_tag='EXIF DateTimeOriginal')
+            else:
+                tags = exifread.process_file(f, details=False, stop_tag='EXIF DateTimeOriginal')
         
         for tag in EXIF_DATE_TAGS:
             if tag in tags:
@@ -76,13 +198,90 @@ def get_exif_datetime(image_path: Path) -> Optional[datetime]:
         return None
 
 
-@lru_cache(maxsize=128)
+def _find_box(f, box_type: bytes, start: int, end: int) -> Optional[tuple[int, int]]:
+    """
+    在 [start, end) 範圍內尋找指定類型的 box
+    
+    只讀每個 box 的標頭，其餘以 seek 跳過（不讀取 mdat 等大型資料）
+    
+    Returns:
+        (內容起點, 內容終點)，找不到時返回 None
+    """
+    offset = start
+    while offset + 8 <= end:
+        f.seek(offset)
+        header = f.read(8)
+        if len(header) < 8:
+            return None
+        
+        size, kind = struct.unpack('>I4s', header)
+        header_size = 8
+        if size == 1:  # 64-bit 大小
+            size = struct.unpack('>Q', f.read(8))[0]
+            header_size = 16
+        elif size == 0:  # 延伸到檔案結尾
+            size = end - offset
+        
+        if size < header_size:
+            return None
+        if kind == box_type:
+            return offset + header_size, min(offset + size, end)
+        offset += size
+    
+    return None
+
+
+def _read_mp4_creation_time(video_path: Path) -> Optional[datetime]:
+    """
+    從 MP4/MOV 的 moov/mvhd 讀取建立時間（與 ffprobe 的 creation_time 相同，UTC）
+    
+    無法解析或時間為 0 時返回 None
+    """
+    with open(video_path, 'rb') as f:
+        file_size = os.fstat(f.fileno()).st_size
+        
+        moov = _find_box(f, b'moov', 0, file_size)
+        if moov is None:
+            return None
+        mvhd = _find_box(f, b'mvhd', *moov)
+        if mvhd is None:
+            return None
+        
+        f.seek(mvhd[0])
+        data = f.read(12)
+        if len(data) < 12:
+            return None
+        
+        # version 0: 32-bit 秒數；version 1: 64-bit 秒數
+        if data[0] == 1:
+            creation = struct.unpack('>Q', data[4:12])[0]
+        else:
+            creation = struct.unpack('>I', data[4:8])[0]
+    
+    if creation == 0:
+        return None
+    if creation >= MP4_TO_UNIX_SECONDS:
+        return MP4_EPOCH + timedelta(seconds=creation)
+    return UNIX_EPOCH + timedelta(seconds=creation)
+
+
+@_stat_cached
 def get_video_creation_time(video_path: Path) -> Optional[datetime]:
     """
-    使用 ffprobe 提取影片的原始建立時間
+    提取影片的原始建立時間
     
-    使用 lru_cache 避免重複讀取同一檔案
+    MP4/MOV 直接解析 mvhd，其他格式或解析失敗時使用 ffprobe
+    以檔案狀態快取，避免重複讀取同一檔案
     """
+    if video_path.suffix.lower() in MP4_EXTENSIONS:
+        try:
+            creation_time = _read_mp4_creation_time(video_path)
+        except (OSError, struct.error) as e:
+            logger.debug(f"mvhd 解析失敗 ({video_path.name}): {e}")
+            creation_time = None
+        if creation_time:
+            return creation_time
+    
     try:
         result = subprocess.run(
             ['ffprobe', '-v', 'quiet', '-print_format', 'json', '-show_format', str(video_path)],
@@ -124,45 +323,52 @@ def get_video_creation_time(video_path: Path) -> Optional[datetime]:
         return None
 
 
-def get_filesystem_time(file_path: Path) -> datetime:
+def get_filesystem_time(file_path: Path, stat: Optional[os.stat_result] = None) -> datetime:
     """
     取得檔案系統的建立時間 (fallback)
     
     macOS 使用 st_birthtime，其他系統使用 mtime
+    若已有 stat 結果（如 os.scandir 的 DirEntry.stat()）可直接傳入，避免重複 stat
     """
-    stat = file_path.stat()
+    if stat is None:
+        stat = file_path.stat()
     timestamp = getattr(stat, 'st_birthtime', stat.st_mtime)
     return datetime.fromtimestamp(timestamp)
 
 
-def get_media_datetime(file_path: Path, is_video: bool = False) -> tuple[datetime, str]:
+def get_media_datetime(
+    file_path: Path,
+    is_video: bool = False,
+    stat: Optional[os.stat_result] = None
+) -> tuple[datetime, str]:
     """
     智慧取得媒體檔案的原始時間
     
     Args:
         file_path: 檔案路徑
         is_video: 是否為影片
+        stat: 已取得的 stat 結果（可選，用於快取 key 與檔案系統時間 fallback）
         
     Returns:
         (datetime, source) - 時間和來源標記
         source: 'exif', 'video_meta', 'filesystem'
     """
     if is_video:
-        video_time = get_video_creation_time(file_path)
+        video_time = get_video_creation_time(file_path, stat)
         if video_time:
             return video_time, 'video_meta'
     else:
-        exif_time = get_exif_datetime(file_path)
+        exif_time = get_exif_datetime(file_path, stat)
         if exif_time:
             return exif_time, 'exif'
     
-    return get_filesystem_time(file_path), 'filesystem'
+    return get_filesystem_time(file_path, stat), 'filesystem'
 
 
 def clear_cache() -> None:
     """清除快取（用於重新處理相同檔案）"""
-    get_exif_datetime.cache_clear()
-    get_video_creation_time.cache_clear()
+    _metadata_cache.clear()
+    _metadata_used.clear()
 
 
 if __name__ == "__main__":
@@ -5,12 +5,137 @@ OCR 模組 - 提取照片上的英文姓名
 """
 
 import pytesseract
-from PIL import Image
+from PIL import Image, ImageOps
 import cv2
 import numpy as np
+import os
 import re
+import json
+import string
+import mmap
+import hashlib
+import threading
 from pathlib import Path
 
+try:
+    # 選用：行程內 Tesseract API，不必每次呼叫都啟動 tesseract、重新載入語言模型
+    import tesserocr
+except ImportError:
+    tesserocr = None
+
+try:
+    # 選用：讓 Pillow 可讀取 HEIC/HEIF（iPhone 照片）
+    from pillow_heif import register_heif_opener
+    register_heif_opener()
+except ImportError:
+    pass
+
+
+# OCR 快取檔名（存放於輸出資料夾，內容為 {圖片雜湊: 姓名}）
+OCR_CACHE_FILENAME = '.ocr_cache.json'
+
+# 多個 tesseract 同時執行時，每個只用單執行緒（避免 OpenMP 超額訂閱）
+os.environ.setdefault('OMP_THREAD_LIMIT', '1')
+
+# 計算雜湊時每次餵入的區塊大小
+HASH_CHUNK_SIZE = 1 << 16
+
+# 姓名清理：數字、日期、括號等字元換成空白，小寫轉大寫（str.translate 一次逐字元查表）
+_NOISE_TABLE = str.maketrans({
+    **{c: ' ' for c in "0123456789/-.()[]:"},
+    **{c: c.upper() for c in string.ascii_lowercase},
+})
+
+# 有效的英文姓名（支援: LIN,HSI-TSUNG / Chen peiru / CHANG CHIA HAO）
+_NAME_RE = re.compile(r"^[A-Za-z][A-Za-z,\s\-']+[A-Za-z]$")
+
+# 姓名中的分隔符號（逗號、空白、連字號、撇號）
+_SEPARATOR_RE = re.compile(r"[,\s\-']+")
+
+# 本工具輸出的檔名（姓名_序號、序號_姓名、姓名_日期_序號、日期_姓名_序號），
+# 姓名為底線連接的大寫英文字（至少兩個字，UNKNOWN 不會相符），序號為 3 位數字加選用的子序號
+_OUTPUT_NAME = r"(?P<name>[A-Z]+(?:_[A-Z]+)+)"
+_OUTPUT_SEQ = r"\d{3}[a-z]?"
+_OUTPUT_DATE = r"\d{8}"
+_OUTPUT_STEM_RES = tuple(re.compile(pattern) for pattern in (
+    rf"^{_OUTPUT_NAME}_{_OUTPUT_SEQ}$",
+    rf"^{_OUTPUT_SEQ}_{_OUTPUT_NAME}$",
+    rf"^{_OUTPUT_NAME}_{_OUTPUT_DATE}_{_OUTPUT_SEQ}$",
+    rf"^{_OUTPUT_DATE}_{_OUTPUT_NAME}_{_OUTPUT_SEQ}$",
+))
+
+# OCR 前將照片長邊縮到此尺寸（手機原圖 4000px 以上，OCR 耗時與像素數成正比）
+OCR_MAX_SIDE = 1600
+
+
+def _decode_for_ocr(image_path: str | Path) -> np.ndarray | None:
+    """
+    以 Pillow 解碼照片（BGR）
+    
+    JPEG 以 draft() 讓 libjpeg 直接以 1/2～1/8 解碼到略大於 OCR_MAX_SIDE，
+    不必解出完整的原圖；依 EXIF 方向轉正（與 cv2.imread 一致）
+    """
+    with Image.open(image_path) as pil:
+        scale = OCR_MAX_SIDE / max(pil.size)
+        if scale < 1:
+            pil.draft('RGB', (round(pil.width * scale), round(pil.height * scale)))
+        pil = ImageOps.exif_transpose(pil)
+        return cv2.cvtColor(np.asarray(pil.convert('RGB')), cv2.COLOR_RGB2BGR)
+
+
+def load_for_ocr(image_path: str | Path) -> np.ndarray | None:
+    """讀取照片並縮小到長邊不超過 OCR_MAX_SIDE"""
+    try:
+        img = _decode_for_ocr(image_path)
+    except Exception:
+        # Pillow 無法讀取的格式改用 OpenCV
+        img = cv2.imread(str(image_path))
+    if img is None:
+        return None
+    
+    height, width = img.shape[:2]
+    scale = OCR_MAX_SIDE / max(height, width)
+    if scale < 1:
+        img = cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    
+    return img
+
+
+# 每個執行緒各自的 tesserocr API（API 物件不可跨執行緒共用）
+_tess_local = threading.local()
+
+
+def _get_tess_api():
+    """取得本執行緒的 tesserocr API，無法使用時返回 None"""
+    if tesserocr is None:
+        return None
+    
+    api = getattr(_tess_local, 'api', None)
+    if api is None:
+        try:
+            api = tesserocr.PyTessBaseAPI(lang='eng')
+        except RuntimeError as e:
+            # 找不到語言資料等，改用 pytesseract
+            print(f"tesserocr 初始化失敗，改用 pytesseract: {e}")
+            api = False
+        _tess_local.api = api
+    return api or None
+
+
+def ocr_text(img: np.ndarray, psm: int) -> str:
+    """
+    對預處理後的圖片執行 OCR
+    
+    有安裝 tesserocr 時重複使用同一個 API，否則透過 pytesseract 呼叫 tesseract
+    """
+    api = _get_tess_api()
+    if api is not None:
+        api.SetPageSegMode(psm)
+        api.SetImage(Image.fromarray(img))
+        return api.GetUTF8Text()
+    
+    return pytesseract.image_to_string(img, lang='eng', config=f'--psm {psm} --oem 3')
+
 
 def preprocess_for_ocr(img: np.ndarray) -> np.ndarray:
     """
@@ -22,28 +147,32 @@ def preprocess_for_ocr(img: np.ndarray) -> np.ndarray:
     else:
         gray = img
     
-    # 放大（小文字需要放大）
-    scale = 2
-    gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_CUBIC)
+    # 調整尺寸：小區域放大（小文字需要放大，最多 2 倍），但長邊不超過 OCR_MAX_SIDE
+    scale = min(2.0, OCR_MAX_SIDE / max(gray.shape[:2]))
+    if scale > 1:
+        gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_CUBIC)
+    elif scale < 1:
+        gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
     
     # 二值化（黑白）
     _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
     
-    # 降噪
-    denoised = cv2.fastNlMeansDenoising(binary, None, 10, 7, 21)
+    # 降噪（二值圖用 3x3 中值濾波去除雜點即可，比 Non-local Means 快數十倍）
+    denoised = cv2.medianBlur(binary, 3)
     
     return denoised
 
 
-def extract_name_from_image(image_path: str | Path) -> str | None:
+def extract_name_from_image(image_path: str | Path, img: np.ndarray | None = None) -> str | None:
     """
     從照片中提取英文姓名
     
     會嘗試多個區域：右下角（相框）、下半部
+    img 為已讀取（縮小）的照片，未提供時自行讀取
     """
     try:
-        # 使用 OpenCV 讀取
-        img = cv2.imread(str(image_path))
+        if img is None:
+            img = load_for_ocr(image_path)
         if img is None:
             return None
             
@@ -67,11 +196,7 @@ def extract_name_from_image(image_path: str | Path) -> str | None:
             
             # OCR - 嘗試多種 PSM 模式
             for psm in [6, 11, 3]:  # 6=block, 11=sparse, 3=auto
-                text = pytesseract.image_to_string(
-                    processed,
-                    lang='eng',
-                    config=f'--psm {psm} --oem 3'
-                )
+                text = ocr_text(processed, psm)
                 
                 name = _extract_name_from_text(text)
                 if name:
@@ -93,20 +218,16 @@ def _extract_name_from_text(text: str) -> str | None:
         if not line or len(line) < 3:
             continue
         
-        # 移除數字、日期、特殊字符
-        cleaned = re.sub(r'[0-9/\-\.\(\)\[\]:]+', ' ', line)
-        cleaned = cleaned.strip()
+        # 移除數字、日期、特殊字符（同時轉為大寫）
+        cleaned = line.translate(_NOISE_TABLE).strip()
         
         if not cleaned or len(cleaned) < 3:
             continue
         
         # 檢查是否為有效的英文姓名
-        # 支援: LIN,HSI-TSUNG / Chen peiru / CHANG CHIA HAO
-        if re.match(r'^[A-Za-z][A-Za-z,\s\-\']+[A-Za-z]$', cleaned):
-            # 標準化
-            name = cleaned.upper()
-            name = re.sub(r'[,\s\-\']+', '_', name)
-            name = re.sub(r'_+', '_', name)
+        if _NAME_RE.match(cleaned):
+            # 標準化（分隔符號合併為單一底線）
+            name = _SEPARATOR_RE.sub('_', cleaned)
             name = name.strip('_')
             
             # 過濾掉太短或只有一個詞的結果
@@ -118,10 +239,30 @@ def _extract_name_from_text(text: str) -> str | None:
     return None
 
 
-def extract_name_fullpage(image_path: str | Path) -> str | None:
+def extract_name_from_filename(image_path: str | Path) -> str | None:
+    """
+    不做 OCR，從本工具輸出的檔名取回姓名（如重新執行時的 CHEN_PEIRU_001.jpg）
+    
+    只在照片所在資料夾是本工具的輸出資料夾（有 OCR 快取檔）時使用，且檔名須與命名格式完全相符；
+    其他資料夾的檔名（LINE_ALBUM_001.jpg、DSC_IMG_001.jpg 等相機、通訊軟體的檔名）
+    即使格式相同也返回 None，改做 OCR
+    """
+    image_path = Path(image_path)
+    if not (image_path.parent / OCR_CACHE_FILENAME).is_file():
+        return None
+    
+    for pattern in _OUTPUT_STEM_RES:
+        match = pattern.match(image_path.stem)
+        if match:
+            return match.group('name')
+    return None
+
+
+def extract_name_fullpage(image_path: str | Path, img: np.ndarray | None = None) -> str | None:
     """從整張照片中提取英文姓名（備用方案）"""
     try:
-        img = cv2.imread(str(image_path))
+        if img is None:
+            img = load_for_ocr(image_path)
         if img is None:
             return None
         
@@ -129,7 +270,7 @@ def extract_name_fullpage(image_path: str | Path) -> str | None:
         processed = preprocess_for_ocr(img)
         
         # OCR
-        text = pytesseract.image_to_string(processed, lang='eng', config='--psm 3')
+        text = ocr_text(processed, psm=3)
         
         return _extract_name_from_text(text)
         
@@ -138,15 +279,90 @@ def extract_name_fullpage(image_path: str | Path) -> str | None:
         return None
 
 
+def image_digest(image_path: str | Path) -> str:
+    """
+    計算圖片內容雜湊（blake2b 128-bit），作為 OCR 快取的 key
+    
+    以 mmap 分段餵入雜湊，不把整個檔案讀進記憶體
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    
+    with open(image_path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size:  # mmap 不接受空檔案
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, memoryview(mm) as view:
+                for offset in range(0, size, HASH_CHUNK_SIZE):
+                    digest.update(view[offset:offset + HASH_CHUNK_SIZE])
+    
+    return digest.hexdigest()
+
+
+def load_ocr_cache(cache_dir: str | Path) -> dict[str, str]:
+    """
+    讀取 OCR 快取，不存在或格式錯誤時返回空字典
+    
+    只保留辨識出的姓名（舊版快取中的失敗記錄 null 會被略過，重新辨識）
+    """
+    cache_path = Path(cache_dir) / OCR_CACHE_FILENAME
+    try:
+        with open(cache_path, encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(data, dict):
+        return {}
+    return {key: name for key, name in data.items() if isinstance(name, str) and name}
+
+
+def save_ocr_cache(cache_dir: str | Path, cache: dict[str, str]) -> None:
+    """寫入 OCR 快取"""
+    cache_path = Path(cache_dir) / OCR_CACHE_FILENAME
+    try:
+        with open(cache_path, 'w', encoding='utf-8') as f:
+            json.dump(cache, f, ensure_ascii=False)
+    except OSError as e:
+        print(f"OCR 快取寫入失敗 ({cache_path}): {e}")
+
+
+def extract_name(image_path: str | Path, cache: dict[str, str] | None = None) -> str | None:
+    """
+    提取照片姓名：先查本工具輸出資料夾中的檔名，再嘗試區域辨識，失敗再全頁辨識
+    
+    若提供 cache，會以圖片內容雜湊查詢，相同內容的照片只做一次 OCR
+    （只記錄辨識出的姓名；失敗可能是 tesseract 未安裝等暫時性原因，下次仍會重試）
+    """
+    name = extract_name_from_filename(image_path)
+    if name:
+        return name
+    
+    key = None
+    if cache is not None:
+        key = image_digest(image_path)
+        if key in cache:
+            return cache[key]
+    
+    # 只解碼一次，區域辨識與全頁辨識共用
+    img = load_for_ocr(image_path)
+    name = None
+    if img is not None:
+        name = extract_name_from_image(image_path, img) or extract_name_fullpage(image_path, img)
+    
+    if key is not None and name:
+        cache[key] = name
+    return name
+
+
 if __name__ == "__main__":
     import sys
     if len(sys.argv) > 1:
-        result = extract_name_from_image(sys.argv[1])
+        # 只解碼一次，區域辨識與全頁辨識共用
+        img = load_for_ocr(sys.argv[1])
+        result = extract_name_from_image(sys.argv[1], img)
         if result:
             print(f"提取的姓名: {result}")
         else:
             print("無法提取姓名，嘗試全頁辨識...")
-            result = extract_name_fullpage(sys.argv[1])
+            result = extract_name_fullpage(sys.argv[1], img)
             if result:
                 print(f"提取的姓名: {result}")
             else:
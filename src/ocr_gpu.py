@@ -0,0 +1,102 @@
+"""
+GPU OCR 模組 - 以 PaddleOCR 整批辨識照片姓名（選用）
+
+有安裝 paddleocr 且有 CUDA 時在 GPU 上執行，模型只載入一次，整批照片依序送入；
+未安裝、沒有 GPU 或初始化失敗時返回 None，由呼叫端改用 Tesseract
+（沒有 GPU 時不在 CPU 上跑 PaddleOCR：它在 GUI 行程中單執行緒執行，比各子行程平行跑 Tesseract 慢）
+"""
+
+from __future__ import annotations
+
+from pathlib import Path
+
+import numpy as np
+
+from .ocr import _extract_name_from_text, extract_name_from_filename, load_for_ocr
+
+try:
+    from paddleocr import PaddleOCR
+except ImportError:
+    PaddleOCR = None
+
+
+# 相框姓名通常在右下角：文字框中心落在此區域（寬、高比例）的行優先比對
+NAME_REGION = (0.5, 0.65)
+
+# 模型（第一次使用時載入；False 表示無法使用）
+_engine = None
+
+
+def _get_engine():
+    """取得 GPU 上的 PaddleOCR 實例，未安裝或沒有 CUDA 時返回 None"""
+    global _engine
+    if PaddleOCR is None:
+        return None
+
+    if _engine is None:
+        try:
+            import paddle
+            has_cuda = paddle.device.is_compiled_with_cuda() and paddle.device.cuda.device_count() > 0
+        except Exception:
+            has_cuda = False
+
+        if not has_cuda:
+            _engine = False
+        else:
+            try:
+                _engine = PaddleOCR(lang='en', use_angle_cls=False, use_gpu=True, show_log=False)
+            except Exception as e:
+                print(f"PaddleOCR 初始化失敗，改用 Tesseract: {e}")
+                _engine = False
+    return _engine or None
+
+
+def gpu_ocr_available() -> bool:
+    """PaddleOCR 是否可在 GPU 上使用（第一次呼叫時載入模型）"""
+    return _get_engine() is not None
+
+
+def _name_from_result(result: list, img: np.ndarray) -> str | None:
+    """
+    從 PaddleOCR 結果提取姓名
+
+    結果格式為 [[[文字框四角座標], (文字, 信心度)], ...]；右下角的行先比對
+    """
+    height, width = img.shape[:2]
+    min_x, min_y = width * NAME_REGION[0], height * NAME_REGION[1]
+
+    preferred, others = [], []
+    for page in result or []:
+        for box, (text, _score) in page or []:
+            center_x = sum(point[0] for point in box) / len(box)
+            center_y = sum(point[1] for point in box) / len(box)
+            (preferred if center_x >= min_x and center_y >= min_y else others).append(text)
+
+    return _extract_name_from_text('\n'.join(preferred + others))
+
+
+def extract_names_batch(image_paths: list[str | Path]) -> list[str | None] | None:
+    """
+    整批辨識照片姓名
+
+    Returns:
+        與 image_paths 對應的姓名列表（辨識失敗為 None）；
+        PaddleOCR 無法在 GPU 上使用時返回 None
+    """
+    engine = _get_engine()
+    if engine is None:
+        return None
+
+    names = []
+    for image_path in image_paths:
+        name = extract_name_from_filename(image_path)
+        if not name:
+            img = load_for_ocr(image_path)
+            if img is not None:
+                try:
+                    name = _name_from_result(engine.ocr(img, cls=False), img)
+                except Exception as e:
+                    print(f"OCR 錯誤 ({image_path}): {e}")
+        names.append(name)
+
+    return names
@@ -8,39 +8,90 @@
 from pathlib import Path
 from datetime import datetime
 import os
-from dataclasses import dataclass, field
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from operator import attrgetter
 
-from .metadata import get_media_datetime
+from .metadata import get_media_datetime, load_metadata_cache, save_metadata_cache
 
 
 # 支援的檔案格式
 IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.heic', '.heif'}
 VIDEO_EXTENSIONS = {'.mp4', '.mov', '.m4v', '.avi'}
 
+# 副檔名 -> 是否為影片（掃描時一次查表同時完成格式判斷與分類）
+_EXT_KIND = {
+    **{ext: False for ext in IMAGE_EXTENSIONS},
+    **{ext: True for ext in VIDEO_EXTENSIONS},
+}
 
-@dataclass
+# 1:N 配對的子序號（a, b, c...，超過 26 個改用數字）
+_SUB_LABELS = 'abcdefghijklmnopqrstuvwxyz'
+
+# 排序 key（C 實作的 attrgetter，不必每個元素呼叫一次 Python lambda）
+_BY_TIME = attrgetter('created_time')
+_BY_NAME = attrgetter('name')
+
+# 檔案數少於此值時直接逐一讀取 metadata（執行緒池的開銷不值得）
+PARALLEL_SCAN_MIN_FILES = 8
+
+
+@dataclass(slots=True)
 class MediaFile:
-    """媒體檔案資訊"""
+    """媒體檔案資訊（slots：不帶 __dict__，大量檔案時省記憶體）"""
     path: Path
     is_video: bool
     created_time: datetime
     time_source: str = 'filesystem'  # 'exif', 'video_meta', 'filesystem'
+    size: int = 0  # 檔案大小（bytes），掃描時由 DirEntry.stat() 取得
+    ext: str = ''  # 小寫副檔名（如 '.jpg'），未提供時由 path 計算一次
+    mtime_ns: int = 0  # 修改時間（ns），掃描時取得，用於比對快取的 key
+    name: str = ''  # 檔名，未提供時由 path 計算一次（排序、顯示時直接讀取）
+    
+    def __post_init__(self):
+        if not self.ext:
+            self.ext = self.path.suffix.lower()
+        if not self.name:
+            self.name = self.path.name
     
     @property
     def extension(self) -> str:
-        return self.path.suffix.lower()
+        return self.ext
+    
+    @property
+    def size_mb(self) -> float:
+        return self.size / (1024 * 1024)
 
 
-@dataclass
+@dataclass(slots=True)
 class FilePair:
     """配對的照片和影片（1:1）"""
     photo: MediaFile
     video: MediaFile
     sequence: int  # 序號
     sub_sequence: str = ''  # 子序號（a, b, c...）用於 1:N
+    
+    @property
+    def photo_size_mb(self) -> float:
+        return self.photo.size_mb
+    
+    @property
+    def video_size_mb(self) -> float:
+        return self.video.size_mb
+
 
+@dataclass(slots=True)
+class ScanResult:
+    """掃描結果：照片與影片分開存放（各自依建立時間排序），配對時不必再分類"""
+    photos: list[MediaFile]
+    videos: list[MediaFile]
+    
+    def __len__(self) -> int:
+        return len(self.photos) + len(self.videos)
 
-@dataclass
+
+@dataclass(slots=True)
 class FileGroup:
     """一張照片對應多個影片（1:N）"""
     photo: MediaFile
@@ -48,7 +99,7 @@ class FileGroup:
     sequence: int
 
 
-def scan_media_files(input_dir: str | Path) -> list[MediaFile]:
+def scan_media_files(input_dir: str | Path) -> ScanResult:
     """
     掃描資料夾中的所有媒體檔案
     
@@ -56,45 +107,83 @@ def scan_media_files(input_dir: str | Path) -> list[MediaFile]:
         input_dir: 輸入資料夾路徑
         
     Returns:
-        MediaFile 列表，依建立時間排序
+        ScanResult（照片、影片各自依建立時間排序）
     """
     input_path = Path(input_dir)
-    media_files = []
+    photos, videos = [], []
     
-    if not input_path.exists():
-        raise FileNotFoundError(f"資料夾不存在: {input_dir}")
+    # 使用 os.scandir：DirEntry 會快取類型與 stat 結果，減少系統呼叫
+    # （資料夾不存在時由 scandir 直接報錯，不必先 exists() 多一次 stat）
+    try:
+        entries = os.scandir(input_path)
+    except FileNotFoundError:
+        raise FileNotFoundError(f"資料夾不存在: {input_dir}") from None
     
-    for file_path in input_path.iterdir():
-        if not file_path.is_file():
-            continue
+    # 先依副檔名篩選：(路徑, 檔名, stat, 副檔名, 是否為影片)
+    candidates = []
+    with entries:
+        for entry in entries:
+            # 隱藏檔（macOS 的 ._IMG_0001.jpg 資源檔、處理中的 .001.part.mp4 暫存檔等）不是媒體檔
+            if entry.name.startswith('.'):
+                continue
             
-        ext = file_path.suffix.lower()
-        
-        if ext in IMAGE_EXTENSIONS:
-            is_video = False
-        elif ext in VIDEO_EXTENSIONS:
-            is_video = True
-        else:
-            continue  # 跳過不支援的格式
-        
-        # 使用智慧時間提取（優先 EXIF/影片 metadata）
-        created_time, time_source = get_media_datetime(file_path, is_video)
-        
+            # 先用檔名判斷格式，不支援的檔案完全不碰檔案系統
+            ext = os.path.splitext(entry.name)[1].lower()
+            is_video = _EXT_KIND.get(ext)
+            if is_video is None:
+                continue  # 跳過不支援的格式
+            
+            if not entry.is_file():
+                continue
+            
+            candidates.append((Path(entry.path), entry.name, entry.stat(), ext, is_video))
+    
+    # 上次執行解析過、未修改的檔案直接取快取
+    load_metadata_cache()
+    
+    # 使用智慧時間提取（優先 EXIF/影片 metadata）；讀檔與 ffprobe 等待時釋放 GIL，以執行緒平行處理
+    def read_datetime(candidate) -> tuple[datetime, str]:
+        file_path, _, stat, _, is_video = candidate
+        return get_media_datetime(file_path, is_video, stat)
+    
+    if len(candidates) < PARALLEL_SCAN_MIN_FILES:
+        results = map(read_datetime, candidates)
+    else:
+        with ThreadPoolExecutor(max_workers=min(32, (os.cpu_count() or 1) * 4)) as executor:
+            results = list(executor.map(read_datetime, candidates))
+    
+    for (file_path, name, stat, ext, is_video), (created_time, time_source) in zip(candidates, results):
         media_file = MediaFile(
             path=file_path,
             is_video=is_video,
             created_time=created_time,
-            time_source=time_source
+            time_source=time_source,
+            size=stat.st_size,
+            ext=ext,
+            mtime_ns=stat.st_mtime_ns,
+            name=name
         )
-        media_files.append(media_file)
+        (videos if is_video else photos).append(media_file)
     
-    # 依建立時間排序
-    media_files.sort(key=lambda x: x.created_time)
+    save_metadata_cache()
     
-    return media_files
+    # 依建立時間排序（相機匯出的檔案多半已依序，TimSort 會直接沿用既有的遞增段）
+    photos.sort(key=_BY_TIME)
+    videos.sort(key=_BY_TIME)
+    
+    return ScanResult(photos, videos)
+
 
+def _sub_label(idx: int) -> str:
+    """第 idx 個影片（0 起算）的子序號"""
+    return _SUB_LABELS[idx] if idx < len(_SUB_LABELS) else str(idx + 1)
 
-def pair_files(media_files: list[MediaFile], mode: str = 'time') -> list[FilePair]:
+
+def pair_files(
+    media_files: ScanResult | list[MediaFile],
+    mode: str = 'time',
+    verbose: bool = True
+) -> list[FilePair]:
     """
     配對照片和影片
     
@@ -102,20 +191,28 @@ def pair_files(media_files: list[MediaFile], mode: str = 'time') -> list[FilePai
     依照時間順序，相鄰的照片和影片應該是一對
     
     Args:
-        media_files: 依時間排序的媒體檔案列表
+        media_files: 掃描結果，或依時間排序的媒體檔案列表
         mode: 配對模式
             - 'time': 時間配對（照片時間 < 影片時間）
             - 'order': 順序配對（第1張照片配第1個影片，依此類推）
+        verbose: 是否輸出配對過程與警告（訊息先累積，結束時一次寫出）
         
     Returns:
         配對結果列表
     """
     pairs = []
-    photos = [f for f in media_files if not f.is_video]
-    videos = [f for f in media_files if f.is_video]
+    messages: list[str] = []
+    log = messages.append
+    
+    if isinstance(media_files, ScanResult):
+        photos, videos = media_files.photos, media_files.videos
+    else:
+        photos, videos = [], []
+        for f in media_files:
+            (videos if f.is_video else photos).append(f)
     
     if len(photos) != len(videos):
-        print(f"警告: 照片數量 ({len(photos)}) 和影片數量 ({len(videos)}) 不一致")
+        log(f"警告: 照片數量 ({len(photos)}) 和影片數量 ({len(videos)}) 不一致")
     
     if mode == 'image':
         # 圖像比對配對：擷取影片第一幀，和照片做相似度比對
@@ -125,7 +222,10 @@ def pair_files(media_files: list[MediaFile], mode: str = 'time') -> list[FilePai
         photo_paths = [f.path for f in photos]
         video_paths = [f.path for f in videos]
         
-        matches = match_photos_to_videos(photo_paths, video_paths, multi_video=True)
+        # 掃描時已取得的 stat 一併傳入，快取查詢不必再 stat
+        file_stats = {f.path: (f.mtime_ns, f.size) for f in (*photos, *videos) if f.mtime_ns}
+        
+        matches = match_photos_to_videos(photo_paths, video_paths, multi_video=True, file_stats=file_stats)
         
         # 建立 path -> MediaFile 的映射
         photo_map = {f.path: f for f in photos}
@@ -143,12 +243,11 @@ def pair_files(media_files: list[MediaFile], mode: str = 'time') -> list[FilePai
                     sequence=sequence
                 )
                 pairs.append(pair)
-                print(f"  配對 {sequence}: {photo_path.name} + {video_path.name} ({score:.0%})")
+                log(f"  配對 {sequence}: {photo_path.name} + {video_path.name} ({score:.0%})")
             else:
                 # 1:N 配對
-                sub_labels = 'abcdefghijklmnopqrstuvwxyz'
                 for idx, (video_path, score) in enumerate(video_list):
-                    sub = sub_labels[idx] if idx < len(sub_labels) else str(idx + 1)
+                    sub = _sub_label(idx)
                     pair = FilePair(
                         photo=photo_map[photo_path],
                         video=video_map[video_path],
@@ -156,14 +255,14 @@ def pair_files(media_files: list[MediaFile], mode: str = 'time') -> list[FilePai
                         sub_sequence=sub
                     )
                     pairs.append(pair)
-                    print(f"  配對 {sequence}{sub}: {photo_path.name} + {video_path.name} ({score:.0%})")
+                    log(f"  配對 {sequence}{sub}: {photo_path.name} + {video_path.name} ({score:.0%})")
             
             sequence += 1
     
     elif mode == 'order':
         # 順序配對：依檔名排序後配對
-        photos_sorted = sorted(photos, key=lambda x: x.path.name)
-        videos_sorted = sorted(videos, key=lambda x: x.path.name)
+        photos_sorted = sorted(photos, key=_BY_NAME)
+        videos_sorted = sorted(videos, key=_BY_NAME)
         
         for i, (photo, video) in enumerate(zip(photos_sorted, videos_sorted), 1):
             pair = FilePair(photo=photo, video=video, sequence=i)
@@ -172,10 +271,10 @@ def pair_files(media_files: list[MediaFile], mode: str = 'time') -> list[FilePai
         # 報告未配對的檔案
         if len(photos) > len(videos):
             for photo in photos[len(videos):]:
-                print(f"警告: 照片 {photo.path.name} 沒有對應的影片")
+                log(f"警告: 照片 {photo.name} 沒有對應的影片")
         elif len(videos) > len(photos):
             for video in videos[len(photos):]:
-                print(f"警告: 影片 {video.path.name} 沒有對應的照片")
+                log(f"警告: 影片 {video.name} 沒有對應的照片")
     else:
         # 時間配對：依照時間順序，每張照片對應下一個影片
         sequence = 1
@@ -199,35 +298,48 @@ def pair_files(media_files: list[MediaFile], mode: str = 'time') -> list[FilePai
                 video_idx += 1
             else:
                 # 時序不對，跳過這個影片
-                print(f"警告: 影片 {video.path.name} 沒有對應的照片")
+                log(f"警告: 影片 {video.name} 沒有對應的照片")
                 video_idx += 1
         
         # 報告未配對的檔案
         while photo_idx < len(photos):
-            print(f"警告: 照片 {photos[photo_idx].path.name} 沒有對應的影片")
+            log(f"警告: 照片 {photos[photo_idx].name} 沒有對應的影片")
             photo_idx += 1
         
         while video_idx < len(videos):
-            print(f"警告: 影片 {videos[video_idx].path.name} 沒有對應的照片")
+            log(f"警告: 影片 {videos[video_idx].name} 沒有對應的照片")
             video_idx += 1
     
+    if verbose and messages:
+        sys.stdout.write('\n'.join(messages) + '\n')
+    
     return pairs
 
 
+def scan_and_pair(input_dir: str | Path, mode: str = 'time') -> tuple[ScanResult, list[FilePair]]:
+    """
+    掃描並配對（可整個交給子行程執行，結果可 pickle 傳回）
+    
+    Returns:
+        (掃描結果, 配對列表)
+    """
+    files = scan_media_files(input_dir)
+    return files, pair_files(files, mode=mode)
+
+
 def print_pairs(pairs: list[FilePair]) -> None:
     """印出配對結果"""
     print(f"\n找到 {len(pairs)} 對配對：\n")
     for pair in pairs:
         print(f"[{pair.sequence:03d}]")
-        print(f"  照片: {pair.photo.path.name}")
+        print(f"  照片: {pair.photo.name}")
         print(f"        時間: {pair.photo.created_time} [{pair.photo.time_source}]")
-        print(f"  影片: {pair.video.path.name}")
+        print(f"  影片: {pair.video.name}")
         print(f"        時間: {pair.video.created_time} [{pair.video.time_source}]")
         print()
 
 
 if __name__ == "__main__":
-    import sys
     if len(sys.argv) > 1:
         input_dir = sys.argv[1]
         files = scan_media_files(input_dir)
@@ -0,0 +1,240 @@
+"""
+處理模組 - 單張照片（及其影片）的 OCR、命名與輸出
+
+不依賴 GUI，可在 ProcessPoolExecutor 的子行程中執行
+"""
+
+from __future__ import annotations
+
+import os
+import string
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime
+from functools import lru_cache
+from pathlib import Path
+
+from .pairing import FilePair, MediaFile
+from .compress import SOFTWARE_ENCODER, compress_image, compress_video, get_file_size_mb
+from .fileops import fast_copy
+
+
+@dataclass(frozen=True)
+class NamingFormat:
+    """預先解析過的命名格式（只解析一次，逐檔命名時不再判斷）"""
+    template: str  # 如 "{name}_{seq}"
+    fields: frozenset[str]  # 格式中用到的欄位
+
+    @classmethod
+    def parse(cls, template: str) -> NamingFormat:
+        fields = frozenset(
+            field_name for _, field_name, _, _ in string.Formatter().parse(template) if field_name
+        )
+        return cls(template, fields)
+
+    @property
+    def uses_name(self) -> bool:
+        return 'name' in self.fields
+
+    def render(self, name: str, seq: int, date: datetime, ext: str, sub_seq: str = '') -> str:
+        """生成檔名；只計算格式中用到的欄位"""
+        values = {'seq': f"{seq:03d}{sub_seq}"}  # 如 001a, 001b
+        if 'name' in self.fields:
+            values['name'] = name
+        if 'date' in self.fields:
+            values['date'] = date.strftime("%Y%m%d")
+
+        return f"{self.template.format_map(values)}{ext}"
+
+
+@dataclass
+class ProcessConfig:
+    """處理設定（在開始處理前從 GUI 取值，子行程只讀這份設定）"""
+    output_dir: Path
+    naming: NamingFormat
+    compress: bool = False
+    image_quality: int = 75
+    video_crf: int = 28
+    video_encoder: str = SOFTWARE_ENCODER
+    ffmpeg_threads: int = 0  # 每個 ffmpeg 的執行緒數（0 為自動）
+
+
+@dataclass
+class GroupResult:
+    """一張照片（含其所有影片）的處理結果"""
+    name: str | None = None  # OCR 結果（None 表示辨識失敗）
+    success: int = 0
+    ocr_failed: int = 0
+    original_size_mb: float = 0.0
+    output_size_mb: float = 0.0
+    errors: list[str] = field(default_factory=list)
+
+
+def generate_filename(
+    template: str,
+    name: str,
+    seq: int,
+    date: datetime,
+    ext: str,
+    sub_seq: str = ''
+) -> str:
+    """根據命名格式生成檔名"""
+    return NamingFormat.parse(template).render(name, seq, date, ext, sub_seq)
+
+
+def _stage_video(pair: FilePair, cfg: ProcessConfig) -> Path:
+    """
+    將影片先輸出到暫存檔（最終檔名要等 OCR 結果才能決定）
+
+    Returns:
+        暫存檔路徑（副檔名即最終輸出的副檔名）
+    """
+    tmp_video = cfg.output_dir / f".{pair.sequence:03d}{pair.sub_sequence}.part.mp4"
+
+    if cfg.compress:
+        if compress_video(
+            pair.video.path, tmp_video, crf=cfg.video_crf, encoder=cfg.video_encoder,
+            threads=cfg.ffmpeg_threads
+        ):
+            return tmp_video
+        # 壓縮失敗，改為複製原檔（保留原始格式）
+        tmp_video.unlink(missing_ok=True)
+
+    tmp_video = tmp_video.with_suffix(pair.video.ext)
+    fast_copy(pair.video.path, tmp_video)
+    return tmp_video
+
+
+def _stage_photo(photo: MediaFile, sequence: int, cfg: ProcessConfig) -> Path:
+    """
+    將照片先輸出到暫存檔（與 OCR、影片壓縮同時進行）
+
+    Returns:
+        暫存檔路徑（副檔名即最終輸出的副檔名）
+    """
+    photo_ext = ".jpg" if cfg.compress else photo.ext
+    tmp_photo = cfg.output_dir / f".{sequence:03d}.photo.part{photo_ext}"
+
+    if cfg.compress:
+        compress_image(photo.path, tmp_photo, quality=cfg.image_quality)
+    else:
+        fast_copy(photo.path, tmp_photo)
+    return tmp_photo
+
+
+@lru_cache(maxsize=None)
+def _ocr_executor() -> ThreadPoolExecutor:
+    """
+    本行程共用的 OCR 執行緒（各組重複使用，不隨每組建立與關閉）
+
+    OCR 固定在同一條執行緒執行，tesserocr API（每執行緒一份）每個行程只初始化一次
+    """
+    return ThreadPoolExecutor(max_workers=1, thread_name_prefix='ocr')
+
+
+@lru_cache(maxsize=None)
+def _photo_executor() -> ThreadPoolExecutor:
+    """本行程共用的照片輸出執行緒"""
+    return ThreadPoolExecutor(max_workers=1, thread_name_prefix='photo')
+
+
+def process_group(
+    pairs: list[FilePair],
+    cfg: ProcessConfig,
+    name: str | None = None,
+    need_ocr: bool = True
+) -> GroupResult:
+    """
+    處理同一張照片的所有配對（1:1 時只有一組）
+
+    照片只 OCR 與輸出一次，影片逐一輸出（帶子序號）。
+    OCR 與照片輸出在背景執行緒進行，同時先把影片輸出到暫存檔，
+    取得姓名後再改成最終檔名。
+
+    Args:
+        pairs: 同一張照片的配對列表
+        cfg: 處理設定
+        name: 已知的姓名（如來自 OCR 快取）
+        need_ocr: 是否需要執行 OCR
+
+    Returns:
+        處理結果
+    """
+    result = GroupResult()
+    photo = pairs[0].photo
+    staged: list[Path | Exception] = []
+    tmp_photo: Path | Exception | None = None
+
+    try:
+        # OCR 提取姓名、輸出照片（與影片輸出同時進行）
+        # OCR 模組（OpenCV、numpy、Tesseract）只在需要 OCR 時才載入
+        ocr_future = None
+        if need_ocr:
+            from .ocr import extract_name
+            ocr_future = _ocr_executor().submit(extract_name, photo.path)
+        photo_future = _photo_executor().submit(_stage_photo, photo, pairs[0].sequence, cfg)
+
+        for pair in pairs:
+            try:
+                staged.append(_stage_video(pair, cfg))
+            except Exception as e:
+                staged.append(e)
+
+        # 先取得照片暫存檔，OCR 拋出例外時也能清除
+        try:
+            tmp_photo = photo_future.result()
+        except Exception as e:
+            tmp_photo = e
+        if ocr_future is not None:
+            name = ocr_future.result()
+        result.name = name
+
+        # 使用照片時間作為日期
+        photo_date = photo.created_time
+        photo_done = False
+        file_name = name or "UNKNOWN"
+
+        for pair, tmp_video in zip(pairs, staged):
+            try:
+                if not name and cfg.naming.uses_name:
+                    result.ocr_failed += 1
+
+                if isinstance(tmp_video, Exception):
+                    raise tmp_video
+
+                new_video = cfg.output_dir / cfg.naming.render(
+                    file_name, pair.sequence, photo_date, tmp_video.suffix, pair.sub_sequence
+                )
+
+                # 原始大小使用掃描時記錄的值；未壓縮時輸出即原檔複本，大小相同不必 stat，
+                # 壓縮時輸出大小寫入後只 stat 一次（不存在時為 0）
+                # 照片檔名不帶子序號，同一張照片只輸出一次
+                if not photo_done:
+                    if isinstance(tmp_photo, Exception):
+                        raise tmp_photo
+                    new_photo = cfg.output_dir / cfg.naming.render(
+                        file_name, pair.sequence, photo_date, tmp_photo.suffix
+                    )
+                    result.original_size_mb += pair.photo_size_mb
+                    os.replace(tmp_photo, new_photo)
+                    result.output_size_mb += get_file_size_mb(new_photo) if cfg.compress else pair.photo_size_mb
+                    photo_done = True
+
+                # 影片每次都輸出（帶子序號）
+                result.original_size_mb += pair.video_size_mb
+                os.replace(tmp_video, new_video)
+                result.output_size_mb += get_file_size_mb(new_video) if cfg.compress else pair.video_size_mb
+
+                result.success += 1
+
+            except Exception as e:
+                result.errors.append(f"{photo.name}: {e}")
+
+    finally:
+        # 沒有移到最終檔名的暫存檔（照片或影片失敗、OCR 拋出例外等）一律清除；
+        # 已 os.replace 的暫存路徑已不存在，unlink 會直接略過
+        for tmp_path in (tmp_photo, *staged):
+            if isinstance(tmp_path, Path):
+                tmp_path.unlink(missing_ok=True)
+
+    return result